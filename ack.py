@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Acknowledgement sent back from the receiver to the sender as one QR code,
+# the sender then plays only the frames the receiver is missing:
+#
+#   FLIPQRACK/<session>/<total frames>/<covered frames>:<base64 bitmap>
+#
+# The bitmap is the zlib compressed FrameTracker bits, one bit per received
+# frame. A bitmap too large for one code is cut short, the frames past
+# covered count as missing so the sender never skips a needed one.
+
+import zlib
+import base64
+
+import qrcode
+
+from encoder import QR_BORDER
+
+ACK_PREFIX = 'FLIPQRACK/'
+
+# base64 characters of the bitmap, about a version 15 code at 15% ecc
+MAX_ACK_CHARS = 600
+
+# pixels per module of a shown or saved acknowledgement
+ACK_BOX_SIZE = 6
+
+
+def encode_bits(bits):
+    return base64.b64encode(zlib.compress(bytes(bits), 9))
+
+
+def pack_ack(session, total, bits, limit=MAX_ACK_CHARS):
+    # bits: FrameTracker.bits of the receiver
+    size = len(bits)
+    if len(encode_bits(bits)) > limit:
+        # the longest prefix of whole bytes that fits
+        low, high = 0, size
+        while low < high:
+            middle = (low + high + 1) // 2
+            if len(encode_bits(bits[:middle])) <= limit:
+                low = middle
+            else:
+                high = middle - 1
+        size = low
+    covered = min(size * 8, total)
+    return '%s%s/%d/%d:%s' % (ACK_PREFIX, session, total, covered,
+                              encode_bits(bits[:size]))
+
+
+def is_ack(data):
+    return data.startswith(ACK_PREFIX)
+
+
+def parse_ack(data):
+    # (session, total frames, [missing frame numbers]), raises ValueError
+    if not is_ack(data):
+        raise ValueError("not a FlipQR acknowledgement")
+    try:
+        header, encoded = data[len(ACK_PREFIX):].split(':', 1)
+        session, total, covered = header.split('/')
+        total, covered = int(total), int(covered)
+        bits = bytearray(zlib.decompress(base64.b64decode(encoded)))
+    except (TypeError, zlib.error):
+        raise ValueError("malformed acknowledgement")
+    if not 0 <= covered <= min(total, len(bits) * 8):
+        raise ValueError("malformed acknowledgement")
+    missing = [n for n in range(1, covered + 1)
+               if not bits[(n - 1) >> 3] & (1 << ((n - 1) & 7))]
+    return session, total, missing + range(covered + 1, total + 1)
+
+
+def ack_matrix(text):
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M,
+                       border=QR_BORDER)
+    qr.add_data(text)
+    qr.make(fit=True)
+    return qr.modules
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from PyQt4 import QtGui, QtCore
+import encoder
+from ack import ack_matrix, ACK_BOX_SIZE
+from image_factory import matrixImage
+
+
+class AckDialog(QtGui.QDialog):
+
+    # shows the acknowledgement QR to the sender's camera, or saves it as
+    # an image to carry over
+
+    def __init__(self, parent, text, missing):
+        QtGui.QDialog.__init__(self, parent)
+        self.setModal(True)
+        self.matrix = ack_matrix(text)
+
+        vbox = QtGui.QVBoxLayout()
+        lbl_qr = QtGui.QLabel('')
+        lbl_qr.setAlignment(QtCore.Qt.AlignCenter)
+        lbl_qr.setPixmap(QtGui.QPixmap.fromImage(
+            matrixImage(self.matrix, ACK_BOX_SIZE)))
+        vbox.addWidget(lbl_qr)
+
+        lbl_info = QtGui.QLabel(
+            "Show this code to the sender, %d frames missing" % missing)
+        lbl_info.setAlignment(QtCore.Qt.AlignCenter)
+        vbox.addWidget(lbl_info)
+
+        btn_save = QtGui.QPushButton("Save")
+        btn_save.clicked.connect(self.onSave)
+        btn_close = QtGui.QPushButton("Close")
+        btn_close.clicked.connect(self.accept)
+
+        hbox = QtGui.QHBoxLayout()
+        hbox.addStretch(1)
+        hbox.addWidget(btn_save)
+        hbox.addWidget(btn_close)
+        vbox.addLayout(hbox)
+
+        self.setLayout(vbox)
+        self.setWindowTitle('FlipQR acknowledgement')
+
+    def onSave(self):
+        fd = QtGui.QFileDialog(self)
+        filename = unicode(fd.getSaveFileName(self, '', 'flipqr-ack.png'))
+        if filename:
+            encoder.write_png(filename, self.matrix, ACK_BOX_SIZE)
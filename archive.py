@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Container for sending a directory in one session:
+#
+#   magic        4 bytes  MAGIC
+#   version      1 byte   VERSION
+#   count        varint   number of files
+#   count times: varint path length, utf-8 path relative to the directory
+#                with / separators, varint size, md5 (16 bytes)
+#   the file contents, in manifest order
+#
+# Archive presents the container as a read only file, the file contents
+# are read from disk when they are needed.
+
+import os
+import hashlib
+import threading
+from bisect import bisect_right
+from binascii import hexlify, unhexlify
+from multiprocessing.pool import ThreadPool
+from os.path import join, isdir, islink, getsize, realpath, dirname, sep
+
+import constants as const
+from protocol import pack_varint, unpack_varint
+
+MAGIC = b'FQAR'
+VERSION = 1
+
+
+def collect_files(directory):
+    # [(relative path, full path, size)] of the regular files below
+    # directory, symbolic links are skipped
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = sorted([d for d in dirs if not islink(join(root, d))])
+        for name in sorted(names):
+            path = join(root, name)
+            if islink(path) or not os.path.isfile(path):
+                continue
+            relative = os.path.relpath(path, directory).replace(sep, '/')
+            files.append((relative, path, getsize(path)))
+    return files
+
+
+def file_md5(path):
+    md5 = hashlib.md5()
+    fh = open(path, 'rb')
+    while True:
+        chunk = fh.read(const.STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        md5.update(chunk)
+    fh.close()
+    return md5.hexdigest()
+
+
+def pack_manifest(entries):
+    # entries: [(relative path, size, md5 hex)]
+    parts = [MAGIC, bytes(bytearray([VERSION])), pack_varint(len(entries))]
+    for path, size, md5 in entries:
+        name = path.encode('utf-8') if isinstance(path, unicode) else path
+        parts += [pack_varint(len(name)), name, pack_varint(size),
+                  unhexlify(md5)]
+    return b''.join(parts)
+
+
+def parse_manifest(data):
+    # ([(relative path, size, md5 hex)], offset of the first file),
+    # raises ValueError for anything that is not an archive
+    if data[:4] != MAGIC:
+        raise ValueError("not a FlipQR archive")
+    if bytearray(data[4:5]) != bytearray([VERSION]):
+        raise ValueError("unsupported archive version")
+    count, pos = unpack_varint(data, 5)
+    entries = []
+    for i in range(count):
+        length, pos = unpack_varint(data, pos)
+        path = data[pos:pos + length].decode('utf-8')
+        size, pos = unpack_varint(data, pos + length)
+        md5 = hexlify(data[pos:pos + 16])
+        if len(md5) != 32:
+            raise ValueError("truncated manifest")
+        entries.append((path, size, md5))
+        pos += 16
+    return entries, pos
+
+
+def safe_path(directory, path):
+    # where path is unpacked below directory, ValueError for absolute
+    # paths and paths that climb out of it
+    parts = path.split('/')
+    if not path or path.startswith('/') or ':' in parts[0] or \
+            any([p in ('', '.', '..') or '\\' in p or '\x00' in p
+                 for p in parts]):
+        raise ValueError("unsafe path %r" % path)
+    target = join(directory, *parts)
+    root = realpath(directory)
+    if not realpath(target).startswith(root.rstrip(sep) + sep):
+        raise ValueError("unsafe path %r" % path)
+    return target
+
+
+def unpack(data, directory):
+    # writes the files of an archive below directory, returns the written
+    # paths and the paths whose md5 did not match (not written)
+    entries, pos = parse_manifest(data)
+    # nothing is written unless every path is safe
+    targets = [safe_path(directory, path) for path, size, md5 in entries]
+    written = []
+    failed = []
+    for (path, size, md5), target in zip(entries, targets):
+        content = data[pos:pos + size]
+        pos += size
+        if len(content) != size or hashlib.md5(content).hexdigest() != md5:
+            failed.append(path)
+            continue
+        if not isdir(dirname(target)):
+            os.makedirs(dirname(target))
+        fh = open(target, 'wb')
+        fh.write(content)
+        fh.close()
+        written.append(path)
+    return written, failed
+
+
+class Archive(object):
+
+    def __init__(self, directory, progress=None, threads=4):
+        files = collect_files(directory)
+        total = sum([size for relative, path, size in files])
+        done = [0]
+        lock = threading.Lock()
+
+        def digest(entry):
+            md5 = file_md5(entry[1])
+            with lock:
+                done[0] += entry[2]
+            return md5
+
+        # hashlib releases the GIL, the files are hashed in parallel
+        pool = ThreadPool(threads)
+        try:
+            result = pool.map_async(digest, files)
+            while not result.ready():
+                result.wait(0.1)
+                if progress:
+                    progress(done[0], max(total, 1))
+            md5s = result.get()
+        finally:
+            pool.close()
+            pool.join()
+
+        self.manifest = pack_manifest(
+            [(relative, size, md5)
+             for (relative, path, size), md5 in zip(files, md5s)])
+        self.paths = [path for relative, path, size in files]
+        self.starts = []
+        pos = len(self.manifest)
+        for relative, path, size in files:
+            self.starts.append(pos)
+            pos += size
+        self.size = pos
+        self.pos = 0
+        self._fh = None
+        self._fh_index = None
+
+    def __len__(self):
+        return self.size
+
+    def seek(self, pos, whence=0):
+        self.pos = pos if whence == 0 else \
+            self.pos + pos if whence == 1 else self.size + pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, n=-1):
+        end = self.size if n < 0 else min(self.size, self.pos + n)
+        parts = []
+        if self.pos < len(self.manifest):
+            parts.append(self.manifest[self.pos:end])
+            self.pos = min(end, len(self.manifest))
+        while self.pos < end:
+            index = bisect_right(self.starts, self.pos) - 1
+            fh = self.fileAt(index)
+            fh.seek(self.pos - self.starts[index])
+            chunk = fh.read(end - self.pos)
+            if not chunk:
+                raise IOError("%s changed while reading" % self.paths[index])
+            parts.append(chunk)
+            self.pos += len(chunk)
+        return b''.join(parts)
+
+    def fileAt(self, index):
+        if self._fh_index != index:
+            self.close()
+            self._fh = open(self.paths[index], 'rb')
+            self._fh_index = index
+        return self._fh
+
+    def close(self):
+        if self._fh:
+            self._fh.close()
+        self._fh = None
+        self._fh_index = None
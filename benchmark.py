@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# benchmarks, runnable without a camera or a display: micro benchmarks of
+# the renderer and the receiver, and an end to end run of every frame
+# through encode, render, zbar decode and reassembly over a settings matrix
+
+import time
+import random
+import hashlib
+import tempfile
+import qrcode
+from qrcode.exceptions import DataOverflowError
+
+import encoder
+import decoder
+import protocol
+import constants as const
+from receiver import Receiver
+
+try:
+    from PyQt4 import QtGui, QtCore
+    import image_factory
+except ImportError:
+    image_factory = None
+
+RENDER_VERSIONS = [1, 5, 10, 15, 20, 25, 30, 35, 40]
+
+
+def time_call(func, repeat):
+    # average seconds per call
+    started = time.time()
+    for i in range(repeat):
+        func()
+    return (time.time() - started) / repeat
+
+
+def painter_image(matrix, box_size, border=encoder.QR_BORDER):
+    # the old renderer, one QPainter and fillRect per dark module
+    size = (len(matrix) + border * 2) * box_size
+    image = QtGui.QImage(size, size, QtGui.QImage.Format_RGB16)
+    image.fill(QtCore.Qt.white)
+    for row, line in enumerate(matrix):
+        for col, dark in enumerate(line):
+            if dark:
+                painter = QtGui.QPainter(image)
+                painter.fillRect((col + border) * box_size,
+                                 (row + border) * box_size,
+                                 box_size, box_size, QtCore.Qt.black)
+    return image
+
+
+def bench_render(versions=RENDER_VERSIONS, box_size=5, repeat=10):
+    results = []
+    for version in versions:
+        qr = qrcode.QRCode(version=version, border=encoder.QR_BORDER)
+        qr.add_data(b'FLIPQR')
+        qr.make(fit=False)
+        matrix = qr.modules
+
+        result = {
+            "version": version,
+            "modules": len(matrix),
+            "png_ms": time_call(
+                lambda: encoder.png_bytes(matrix, box_size), repeat) * 1000,
+        }
+        if image_factory:
+            result["bulk_ms"] = time_call(
+                lambda: image_factory.matrixImage(matrix, box_size),
+                repeat) * 1000
+            result["painter_ms"] = time_call(
+                lambda: painter_image(matrix, box_size), repeat) * 1000
+        results.append(result)
+    return results
+
+
+# slowest allowed call in milliseconds of the receiver queries the scanner
+# makes while a transfer is in progress
+RECEIVER_LIMITS_MS = {"progress": 1.0, "statusText": 5.0, "ackText": 100.0}
+
+# fractions of the symbols fed when the queries are timed
+RECEIVER_CHECKPOINTS = [0.01, 0.5, 0.99]
+
+
+def time_queries(receiver, repeat=20):
+    # slowest mean time in ms of each query in RECEIVER_LIMITS_MS
+    times = {}
+    for name in RECEIVER_LIMITS_MS:
+        query = getattr(receiver, name)
+        started = time.time()
+        for i in range(repeat):
+            query()
+        times[name] = (time.time() - started) / repeat * 1000
+    return times
+
+
+def bench_receiver(total=100000, payload_size=16, duplicates=0.1):
+    # feeds a shuffled transfer with repeats through the receiver, the
+    # status text is rebuilt after every frame like the scanner does. At
+    # the checkpoints the scanner's queries are timed, the run fails when
+    # one is slower than its limit.
+    data = b''.join([b'%0*d' % (payload_size, i) for i in range(total)])
+    md5 = hashlib.md5(data).hexdigest()
+    meta = {"md5": md5, "type": const.TYPE_BINARY_FILE, "size": len(data),
+            "filename": b'bench.bin'}
+
+    order = list(range(1, total + 1))
+    order += random.sample(order, int(total * duplicates))
+    random.shuffle(order)
+    packets = [protocol.pack_frame(
+        md5[:6], n, total, (n - 1) * payload_size,
+        data[(n - 1) * payload_size:n * payload_size],
+        meta=meta if n == 1 else None) for n in order]
+    checkpoints = set([int(len(packets) * f) for f in RECEIVER_CHECKPOINTS])
+
+    receiver = Receiver()
+    queries = dict([(name, 0.0) for name in RECEIVER_LIMITS_MS])
+    query_seconds = 0.0
+    started = time.time()
+    for i, packet in enumerate(packets):
+        if receiver.feed(packet):
+            receiver.statusText()
+        if i in checkpoints and not receiver.is_done:
+            timed = time.time()
+            for name, ms in time_queries(receiver).items():
+                queries[name] = max(queries[name], ms)
+            query_seconds += time.time() - timed
+    elapsed = time.time() - started - query_seconds
+
+    slow = sorted([name for name, ms in queries.items()
+                   if ms > RECEIVER_LIMITS_MS[name]])
+    return {
+        "frames": total,
+        "symbols": len(packets),
+        "success": receiver.is_success and not slow,
+        "complete": receiver.is_success,
+        "seconds": elapsed,
+        "us_per_symbol": elapsed / len(packets) * 1e6,
+        "query_ms": queries,
+        "slow": slow,
+    }
+
+
+# settings matrix of the end to end benchmark
+MATRIX_ECC = ['7%', '15%', '25%', '30%']
+MATRIX_BOX_SIZES = [2, 3, 5]
+MATRIX_FRAME_SIZES = [100, 400, 1000]
+# payload type: (frame format, data)
+MATRIX_PAYLOADS = {
+    'text': ('text', 'text'),
+    'base64': ('base64', 'random'),
+    'binary': ('binary', 'random'),
+    'compressible': ('binary', 'repetitive'),
+}
+
+
+def payload_data(kind, size):
+    rng = random.Random(size)
+    if kind == 'text':
+        words = [u'flip', u'qr', u'frame', u'二维码', u'data']
+        text = u' '.join([rng.choice(words) for i in range(size // 4 + 1)])
+        return text[:size]
+    if kind == 'repetitive':
+        words = [b'%08x' % rng.getrandbits(32) for i in range(64)]
+        return b' '.join([rng.choice(words)
+                          for i in range(size // 9 + 1)])[:size]
+    return bytes(bytearray([rng.getrandbits(8) for i in range(size)]))
+
+
+def matrix_source(payload, size):
+    # (source, bytes of the payload)
+    frame_format, kind = MATRIX_PAYLOADS[payload]
+    data = payload_data(kind, size)
+    if frame_format == 'text':
+        return encoder.text_source(data), len(data.encode('utf-8'))
+    raw = tempfile.NamedTemporaryFile(prefix='flipqr-bench-')
+    raw.write(data)
+    raw.flush()
+    # file_source keeps its own handle, the data outlives the name
+    source = encoder.file_source(raw.name, frame_format == 'binary')
+    raw.close()
+    return source, len(data)
+
+
+def bench_case(source, size, ecc, box_size, frame_size):
+    # one pass of every frame through encode, render, decode and
+    # reassembly, stage times are summed over the frames
+    frames = encoder.make_encoder(source, frame_size, ecc)
+    times = {"encode": 0.0, "render": 0.0, "render_qt": 0.0,
+             "decode": 0.0, "reassembly": 0.0}
+    receiver = Receiver()
+    decoded = 0
+    for number in range(1, frames.total_frames + 1):
+        started = time.time()
+        payload = frames.payload(number)
+        matrix = frames.matrix(number)
+        times["encode"] += time.time() - started
+
+        started = time.time()
+        job = encoder.gray_pixels(matrix, box_size)
+        times["render"] += time.time() - started
+
+        if image_factory:
+            started = time.time()
+            image_factory.matrixImage(matrix, box_size)
+            times["render_qt"] += time.time() - started
+
+        symbols = [payload]
+        if decoder.zbar:
+            started = time.time()
+            symbols = decoder.scan_gray(job)
+            times["decode"] += time.time() - started
+            decoded += bool(symbols)
+
+        # the scanner's dataHandler and status refresh
+        started = time.time()
+        for symbol in symbols:
+            if receiver.feed(symbol):
+                receiver.statusText()
+        times["reassembly"] += time.time() - started
+
+    count = frames.total_frames
+    total = sum(times.values())
+    result = {
+        "ecc": ecc,
+        "box_size": box_size,
+        "frame_size": frame_size,
+        "frames": count,
+        "payload_bytes": size,
+        "qr_version": max([frames.qrcode(n).version
+                           for n in (1, count)]),
+        "success": receiver.is_success,
+        "skipped": None,
+        "frames_per_second": count / total if total else None,
+        "payload_bytes_per_second": size / total if total else None,
+    }
+    for stage, seconds in times.items():
+        result[stage + "_ms"] = seconds / count * 1000
+    if not image_factory:
+        result["render_qt_ms"] = None
+    if decoder.zbar:
+        result["decoded_frames"] = decoded
+    else:
+        result["decode_ms"] = None
+        result["decoded_frames"] = None
+    return result
+
+
+def bench_matrix(ecc_levels=MATRIX_ECC, box_sizes=MATRIX_BOX_SIZES,
+                 frame_sizes=MATRIX_FRAME_SIZES,
+                 payloads=sorted(MATRIX_PAYLOADS), frames=20, progress=None):
+    # every combination of the settings; a case carries about frames
+    # frames of data. Without zbar the decode stage is skipped and the
+    # encoded payloads go straight to the receiver. Cases whose frames
+    # overflow a QR symbol are reported as skipped.
+    if decoder.zbar:
+        decoder.init_worker()
+    results = []
+    for payload in payloads:
+        for frame_size in frame_sizes:
+            source, size = matrix_source(payload, frame_size * frames)
+            for ecc in ecc_levels:
+                for box_size in box_sizes:
+                    try:
+                        result = bench_case(source, size, ecc, box_size,
+                                            frame_size)
+                    except DataOverflowError:
+                        # the frames do not fit a QR symbol at this level
+                        result = {"ecc": ecc, "box_size": box_size,
+                                  "frame_size": frame_size,
+                                  "payload_bytes": size, "success": None,
+                                  "skipped": "data overflow"}
+                    result["payload"] = payload
+                    results.append(result)
+                    if progress:
+                        progress(result)
+    return {
+        "flipqr_version": const.FLIPQR_VERSION,
+        "zbar": bool(decoder.zbar),
+        "qt": bool(image_factory),
+        "results": results,
+    }
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Decompresses the blocks of a compression.CODEC_BLOCKS stream while the
+# frames arrive. A block is known by its start offset and the frame that
+# holds the start, from the frame header or from the end of the block
+# before it. Its frames are walked in order, the walk remembers the first
+# missing frame so every frame is looked at about once.
+
+from compression import block_end, unpack_block
+
+
+class BlockDecoder(object):
+
+    def __init__(self, frame, total):
+        # frame(number) returns (offset, payload) of a received frame
+        self.frame = frame
+        self.total = total
+        self.codec = None
+        self.starts = {}
+        self.walks = {}
+        self.ends = {}
+        self.waiting = {}
+        self.blocks = {}
+        self._complete = []
+
+    def setCodec(self, codec):
+        self.codec = codec
+        bad = []
+        complete, self._complete = self._complete, []
+        for job in complete:
+            bad += self.decode(*job)
+        return bad
+
+    def frameAdded(self, number, block=None):
+        # block: distance from the frame offset to a block start. Returns
+        # (first, last) frame ranges of blocks that failed to decode
+        bad = []
+        if block is not None:
+            offset = self.frame(number)[0]
+            bad += self.addStart(number, offset + block)
+        for start in self.waiting.pop(number, ()):
+            bad += self.advance(start)
+        return bad
+
+    def addStart(self, number, start):
+        if start in self.starts or number > self.total:
+            return []
+        self.starts[start] = number
+        return self.advance(start)
+
+    def read(self, first, start, stop):
+        # stream bytes [start, stop) from frames first.., None for a gap
+        parts = []
+        number = first
+        while number <= self.total:
+            frame = self.frame(number)
+            if frame is None:
+                return None
+            offset, payload = frame
+            parts.append(payload[max(start - offset, 0):stop - offset])
+            if offset + len(payload) >= stop:
+                return b''.join(parts)
+            number += 1
+        return None
+
+    def advance(self, start):
+        if start in self.blocks:
+            return []
+        first = self.starts[start]
+        number = self.walks.get(start, first)
+        end = self.ends.get(start)
+        while True:
+            frame = self.frame(number) if number <= self.total else None
+            if frame is None:
+                if number > self.total:
+                    # the header points past the stream
+                    return self.fail(start, first, first)
+                self.walks[start] = number
+                self.waiting.setdefault(number, set()).add(start)
+                return []
+            offset, payload = frame
+            stop = offset + len(payload)
+            if end is None:
+                head = self.read(first, start, stop)
+                if head is None:
+                    # a walked frame was discarded, start over
+                    return self.restart(start)
+                try:
+                    end = start + block_end(head, 0)
+                    self.ends[start] = end
+                except ValueError:
+                    pass
+            if end is not None and stop >= end:
+                if self.codec is None:
+                    self._complete.append((start, first, number, end))
+                    return []
+                return self.decode(start, first, number, end)
+            number += 1
+
+    def restart(self, start):
+        # walk again from the first frame, up to the frame now missing
+        self.walks.pop(start, None)
+        self.ends.pop(start, None)
+        return self.advance(start)
+
+    def fail(self, start, first, last):
+        # the receiver discards frames first .. last, wait for them again
+        self.walks.pop(start, None)
+        self.ends.pop(start, None)
+        self.waiting.setdefault(first, set()).add(start)
+        return [(first, last)]
+
+    def decode(self, start, first, last, end):
+        data = self.read(first, start, end)
+        if data is None:
+            return self.restart(start)
+        try:
+            raw, length = unpack_block(self.codec, data, 0)
+        except ValueError:
+            return self.fail(start, first, last)
+        self.blocks[start] = (raw, end)
+        self.walks.pop(start, None)
+
+        # the next block follows right after this one
+        offset, payload = self.frame(last)
+        number = last if end < offset + len(payload) else last + 1
+        return self.addStart(number, end)
+
+    def result(self, length):
+        # the decompressed stream once every block of it is decoded
+        parts = []
+        pos = 0
+        while pos < length:
+            if pos not in self.blocks:
+                return None
+            raw, pos = self.blocks[pos]
+            parts.append(raw)
+        return b''.join(parts)
+
+    @property
+    def decoded(self):
+        return len(self.blocks)
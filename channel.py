@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Simulated camera pointed at the player. Every shown frame is rendered,
+# degraded the way a camera sees a monitor and scanned with zbar into a
+# Receiver, until the transfer completes. Time is counted in shown frames,
+# so a run is reproducible for a seed and independent of the machine.
+#
+# Degradations, applied in this order:
+#   overlap      fraction of the previous frame still visible, the camera
+#                exposure spans the frame change
+#   perspective  corners moved by up to this fraction of the image size
+#   blur         gaussian blur radius in pixels
+#   noise        standard deviation of gaussian sensor noise, 0-255 scale
+#   drop         probability that a frame is not captured at all
+
+import time
+import random
+
+try:
+    from PIL import Image, ImageChops, ImageFilter, ImageOps
+except ImportError:
+    Image = None
+
+import encoder
+import decoder
+from receiver import Receiver
+
+
+class Channel(object):
+
+    def __init__(self, blur=0.0, perspective=0.0, noise=0.0, overlap=0.0,
+                 drop=0.0, seed=0):
+        self.blur = blur
+        self.perspective = perspective
+        self.noise = noise
+        self.overlap = overlap
+        self.drop = drop
+        self.random = random.Random(seed)
+        self.previous = None
+
+    def capture(self, image):
+        # the camera image of a shown PIL 'L' image, None for a dropped one
+        previous, self.previous = self.previous, image
+        if self.random.random() < self.drop:
+            return None
+        if self.overlap and previous is not None and \
+                previous.size == image.size:
+            image = Image.blend(image, previous, self.overlap)
+        if self.perspective:
+            image = self.warp(image)
+        if self.blur:
+            image = image.filter(ImageFilter.GaussianBlur(self.blur))
+        if self.noise:
+            # from the seeded generator, Image.effect_noise is not
+            gauss = self.random.gauss
+            noise = bytearray([
+                min(255, max(0, int(128.5 + gauss(0, self.noise))))
+                for i in range(image.size[0] * image.size[1])])
+            image = ImageChops.add(
+                image, Image.frombytes('L', image.size, bytes(noise)),
+                1.0, -128)
+        return image
+
+    def warp(self, image):
+        # a white margin keeps the moved corners inside the picture
+        width, height = image.size
+        margin = int(max(width, height) * self.perspective) + 1
+        image = ImageOps.expand(image, margin, 255)
+        size = image.size
+
+        def jitter(x, y):
+            shift = self.perspective * max(width, height)
+            return (x + self.random.uniform(-shift, shift),
+                    y + self.random.uniform(-shift, shift))
+
+        # upper left, lower left, lower right, upper right
+        corners = [(0, 0), (0, size[1]), size, (size[0], 0)]
+        moved = [jitter(x, y) for x, y in corners]
+        return image.transform(size, Image.QUAD,
+                               tuple([v for corner in moved
+                                      for v in corner]),
+                               Image.BILINEAR)
+
+
+def render(frames, number, box_size):
+    width, height, pixels = encoder.gray_pixels(frames.matrix(number),
+                                                box_size)
+    return Image.frombytes('L', (width, height), pixels)
+
+
+def simulate(frames, channel, box_size=3, fps=10, max_loops=10,
+             progress=None):
+    # plays frames (an encoder from make_encoder) through the channel into
+    # a fresh receiver, fountain symbols as an endless stream
+    if not Image:
+        raise ImportError("the channel simulator needs Pillow")
+    if not decoder.zbar:
+        raise ImportError("the channel simulator needs the zbar package")
+    decoder.init_worker()
+
+    receiver = Receiver()
+    shown = 0
+    captured = 0
+    scanned = 0
+    limit = frames.total_frames * max_loops
+    started = time.time()
+    while not receiver.is_done and shown < limit:
+        if frames.endless:
+            number = shown + 1
+        else:
+            number = shown % frames.total_frames + 1
+        shown += 1
+        image = channel.capture(render(frames, number, box_size))
+        if image is None:
+            continue
+        captured += 1
+        pixels = image.tobytes()
+        for data in decoder.scan_gray((image.size[0], image.size[1],
+                                       pixels)):
+            scanned += 1
+            receiver.feed(data)
+        if progress:
+            progress(shown, receiver)
+
+    size = len(receiver.result) if receiver.is_success else 0
+    seconds = float(shown) / fps
+    return {
+        "success": receiver.is_success,
+        "frames": frames.total_frames,
+        "shown": shown,
+        "captured": captured,
+        "symbols": scanned,
+        "rejected": receiver.rejected,
+        "loops": float(shown) / frames.total_frames,
+        "time_to_complete": seconds if receiver.is_done else None,
+        "payload_bytes": size,
+        "goodput": size / seconds if receiver.is_success else 0.0,
+        "wall_seconds": time.time() - started,
+    }
@@ -0,0 +1,485 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# headless commands, run without a display
+
+import os
+import sys
+import time
+import codecs
+import argparse
+from os.path import isfile, isdir, join
+
+from qrcode.exceptions import DataOverflowError
+
+import encoder
+import export
+import constants as const
+
+COMMANDS = ('encode', 'decode', 'export', 'bench', 'simulate')
+
+
+def build_source(args):
+    if isdir(args.input) and not args.text:
+        source = encoder.folder_source(args.input, args.binary)
+        if not source:
+            raise SystemExit("%s: nothing to encode" % args.input)
+        return source
+    if not isfile(args.input):
+        raise SystemExit("%s: no such file" % args.input)
+
+    if args.text:
+        source = encoder.text_source(
+            codecs.open(args.input, 'r', 'utf-8').read(), args.binary)
+    else:
+        source = encoder.file_source(args.input, args.binary)
+    if not source:
+        raise SystemExit("%s: nothing to encode" % args.input)
+    return source
+
+
+def overflow_exit(args):
+    raise SystemExit("a frame does not fit in a QR code at ECC %s, use a "
+                     "smaller --frame-size or a lower --ecc" % args.ecc)
+
+
+def frame_numbers(args, source, frames):
+    # the frames to show: all of them, --count fountain symbols, or the
+    # ones missing in an acknowledgement
+    count = frames.total_frames
+    if frames.endless:
+        count = args.count or count * 2
+    if args.ack:
+        if frames.endless:
+            raise SystemExit("--ack needs numbered frames")
+        return read_ack(args.ack, source, frames)
+    return range(1, count + 1)
+
+
+def cmd_encode(args):
+    source = build_source(args)
+    try:
+        frames = encoder.make_encoder(source, args.frame_size, args.ecc,
+                                      args.mode, args.qr_version)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    numbers = frame_numbers(args, source, frames)
+    count = len(numbers)
+
+    if not isdir(args.output):
+        os.makedirs(args.output)
+
+    channels = encoder.CHANNELS if args.color else 1
+    images = (count + channels - 1) // channels
+
+    digits = len(str(images))
+    started = time.time()
+    try:
+        for number in range(1, images + 1):
+            filename = join(args.output, 'frame-%0*d.png' % (digits, number))
+            shown = numbers[(number - 1) * channels:number * channels]
+            if args.color:
+                encoder.write_color_png(filename, frames.matrices(shown),
+                                        args.box_size)
+            else:
+                encoder.write_png(filename, frames.matrix(shown[0]),
+                                  args.box_size)
+    except DataOverflowError:
+        overflow_exit(args)
+    elapsed = time.time() - started
+
+    sys.stdout.write("%d frames in %d images written to %s in %.2fs "
+                     "(%.1f frames/s)\n" % (
+                         count, images, args.output, elapsed,
+                         count / max(elapsed, 1e-6)))
+    return 0
+
+
+def cmd_export(args):
+    source = build_source(args)
+    try:
+        frames = encoder.make_encoder(source, args.frame_size, args.ecc,
+                                      args.mode, args.qr_version)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    numbers = frame_numbers(args, source, frames)
+
+    def progress(done, total):
+        sys.stderr.write("\r%d/%d images" % (done, total))
+
+    started = time.time()
+    try:
+        images = export.export(frames, args.output, numbers, args.fps,
+                               args.box_size, args.color, args.processes,
+                               progress)
+    except DataOverflowError:
+        overflow_exit(args)
+    except (ValueError, IOError, OSError) as e:
+        raise SystemExit(str(e))
+    elapsed = time.time() - started
+    sys.stderr.write("\n")
+    sys.stdout.write("%d frames in %d images written to %s in %.2fs "
+                     "(%.1f images/s, %.1fs at %g fps)\n" % (
+                         len(numbers), images, args.output, elapsed,
+                         images / max(elapsed, 1e-6), images / args.fps,
+                         args.fps))
+    return 0
+
+
+def read_ack(path, source, frames):
+    # the frames the receiver is missing, from a photo of its ack code
+    import decoder
+    import ack
+
+    if not decoder.zbar or not decoder.Image:
+        raise SystemExit("reading --ack needs zbar and Pillow")
+    decoder.init_worker()
+    found = [data for data in decoder.scan_file(path) if ack.is_ack(data)]
+    if not found:
+        raise SystemExit("%s: no acknowledgement code found" % path)
+    try:
+        session, total, missing = ack.parse_ack(found[0])
+    except ValueError as e:
+        raise SystemExit("%s: %s" % (path, e))
+    if session != source['id'] or total != frames.total_frames:
+        raise SystemExit("%s: acknowledgement for another transfer or "
+                         "other frame settings" % path)
+    if not missing:
+        raise SystemExit("%s: the receiver has every frame" % path)
+    return missing
+
+
+def write_ack(path, receiver):
+    import ack
+
+    text = receiver.ackText()
+    if text:
+        encoder.write_png(path, ack.ack_matrix(text), ack.ACK_BOX_SIZE)
+        sys.stderr.write("acknowledgement of %d missing frames written to "
+                         "%s\n" % (receiver.tracker.missing, path))
+
+
+def cmd_decode(args):
+    import decoder
+    from receiver import Receiver
+
+    try:
+        worker, jobs = decoder.open_input(args.input, args.step, args.color)
+    except (ImportError, IOError) as e:
+        raise SystemExit(str(e))
+    if args.crosstalk and not args.color:
+        raise SystemExit("--crosstalk needs --color")
+
+    def progress(images, receiver):
+        if images % 100 == 0:
+            sys.stderr.write("%d images, %s\n" % (
+                images, receiver.statusText()))
+
+    receiver = Receiver()
+    try:
+        result = decoder.decode(worker, jobs, receiver, args.processes,
+                                progress, args.crosstalk)
+    except ImportError as e:
+        raise SystemExit(str(e))
+    sys.stdout.write(
+        "%(images)d images, %(symbols)d symbols in %(seconds).2fs "
+        "(%(images_per_second).1f frames/s)\n" % result)
+    sys.stdout.write(
+        "decode %(decode_ms).2f ms per image, %(duplicates)d duplicates, "
+        "%(rejected)d rejected, %(unreadable)d unreadable, "
+        "%(useful_bytes_per_second).0f useful bytes/s\n" % dict(
+            result, decode_ms=result.get("decode_ms", 0.0)))
+
+    if not receiver.is_done:
+        if args.ack:
+            write_ack(args.ack, receiver)
+        raise SystemExit("incomplete: %s" % receiver.statusText())
+    if not receiver.is_success:
+        raise SystemExit(receiver.error)
+
+    output = args.output
+    if not output:
+        output = receiver.source_filename or 'flipqr.out'
+        output = os.path.basename(output.decode('utf-8'))
+    if receiver.source_type in const.ARCHIVE_TYPES:
+        return unpack_archive(receiver.result, output)
+    fh = open(output, 'wb')
+    fh.write(receiver.result)
+    fh.close()
+    sys.stdout.write("%d bytes written to %s\n" % (
+        len(receiver.result), output))
+    return 0
+
+
+def unpack_archive(data, directory):
+    import archive
+
+    if not isdir(directory):
+        os.makedirs(directory)
+    try:
+        written, failed = archive.unpack(data, directory)
+    except ValueError as e:
+        raise SystemExit("unpack failed: %s" % e)
+    sys.stdout.write("%d files unpacked to %s\n" % (len(written), directory))
+    for path in failed:
+        sys.stderr.write("md5 verify failed, not written: %s\n" % path)
+    return 1 if failed else 0
+
+
+def cmd_simulate(args):
+    import json
+    import channel
+
+    source = build_source(args)
+    try:
+        frames = encoder.make_encoder(source, args.frame_size, args.ecc,
+                                      args.mode, args.qr_version)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    link = channel.Channel(args.blur, args.perspective, args.noise,
+                           args.overlap, args.drop, args.seed)
+
+    def progress(shown, receiver):
+        if shown % 100 == 0:
+            sys.stderr.write("%d frames shown, %s\n" % (
+                shown, receiver.statusText()))
+
+    try:
+        result = channel.simulate(frames, link, args.box_size, args.fps,
+                                  args.max_loops, progress)
+    except DataOverflowError:
+        overflow_exit(args)
+    except ImportError as e:
+        raise SystemExit(str(e))
+    if args.json:
+        sys.stdout.write(json.dumps(result, indent=2, sort_keys=True) + '\n')
+    elif result["success"]:
+        sys.stdout.write(
+            "complete after %(shown)d frames (%(loops).2f loops), "
+            "%(time_to_complete).1fs at the given fps, goodput "
+            "%(goodput).0f bytes/s, %(symbols)d symbols read, "
+            "%(rejected)d rejected\n" % result)
+    else:
+        sys.stdout.write(
+            "incomplete after %(shown)d frames, %(symbols)d symbols read, "
+            "%(rejected)d rejected\n" % result)
+    return 0 if result["success"] else 1
+
+
+def bench_matrix(benchmark, args):
+    import json
+
+    def progress(result):
+        case = "%(payload)s ecc %(ecc)s box %(box_size)d " \
+            "frame %(frame_size)d: " % result
+        if result["skipped"]:
+            sys.stderr.write(case + "skipped, %(skipped)s\n" % result)
+        else:
+            sys.stderr.write(case + "%(frames_per_second).1f frames/s\n" %
+                             result)
+
+    def values(option, default, kind=str):
+        return [kind(v) for v in option.split(',')] if option else default
+
+    report = benchmark.bench_matrix(
+        values(args.ecc_levels, benchmark.MATRIX_ECC),
+        values(args.box_sizes, benchmark.MATRIX_BOX_SIZES, int),
+        values(args.frame_sizes, benchmark.MATRIX_FRAME_SIZES, int),
+        values(args.payloads, sorted(benchmark.MATRIX_PAYLOADS)),
+        args.case_frames, progress)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        fh = open(args.output, 'w')
+        fh.write(text + '\n')
+        fh.close()
+    else:
+        sys.stdout.write(text + '\n')
+    return 0 if all([r["success"] for r in report["results"]
+                     if not r["skipped"]]) else 1
+
+
+def cmd_bench(args):
+    import benchmark
+
+    if args.target == 'matrix':
+        return bench_matrix(benchmark, args)
+
+    if args.target == 'receiver':
+        result = benchmark.bench_receiver(args.frames)
+        sys.stdout.write(
+            "%(symbols)d symbols for %(frames)d frames in %(seconds).2fs, "
+            "%(us_per_symbol).1f us per symbol, complete: %(complete)s\n" %
+            result)
+        for name, ms in sorted(result["query_ms"].items()):
+            sys.stdout.write("%s: %.3f ms, limit %.1f ms%s\n" % (
+                name, ms, benchmark.RECEIVER_LIMITS_MS[name],
+                " TOO SLOW" if name in result["slow"] else ""))
+        return 0 if result["success"] else 1
+
+    versions = [int(v) for v in args.versions.split(',')]
+    results = benchmark.bench_render(versions, args.box_size, args.repeat)
+
+    columns = ['version', 'modules', 'png_ms', 'bulk_ms', 'painter_ms']
+    columns = [c for c in columns if c in results[0]]
+    sys.stdout.write(''.join(['%12s' % c for c in columns]) + '\n')
+    for result in results:
+        sys.stdout.write(''.join(
+            ['%12s' % result[c] if isinstance(result[c], int)
+             else '%12.2f' % result[c] for c in columns]) + '\n')
+    return 0
+
+
+def add_frame_options(parser):
+    parser.add_argument('--text', action='store_true',
+                        help='send input as utf-8 text instead of a file')
+    parser.add_argument('--binary', action='store_true',
+                        help='raw binary frames with compact headers')
+    parser.add_argument('--ecc', default='7%',
+                        choices=sorted(encoder.ECC_LEVELS.keys()))
+    parser.add_argument('--frame-size', type=int, default=100,
+                        help='characters of data per frame')
+    parser.add_argument('--qr-version', type=int, choices=range(1, 41),
+                        metavar='1-40',
+                        help='fixed QR version, frames are filled to its '
+                             'capacity and --frame-size is ignored')
+    parser.add_argument('--mode', default=encoder.MODE_FRAMES,
+                        choices=[encoder.MODE_FRAMES, encoder.MODE_FOUNTAIN])
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog='flipqr', description='FlipQR %s' % const.FLIPQR_VERSION)
+    commands = parser.add_subparsers(dest='command')
+
+    p = commands.add_parser('encode', help='write the QR movie as PNG files')
+    p.add_argument('input', help='file, or directory sent as one archive')
+    p.add_argument('-o', '--output', default='.',
+                   help='directory for the PNG files')
+    p.add_argument('--box-size', type=int, default=5,
+                   help='pixels per QR module')
+    p.add_argument('--count', type=int, default=0,
+                   help='symbols to write in fountain mode, '
+                        'twice the block count by default')
+    p.add_argument('--color', action='store_true',
+                   help='three frames per image, one in each rgb channel')
+    p.add_argument('--ack', metavar='IMAGE',
+                   help='write only the frames missing in the receiver '
+                        'acknowledgement shown in IMAGE')
+    add_frame_options(p)
+    p.set_defaults(func=cmd_encode)
+
+    p = commands.add_parser(
+        'export', help='write the QR movie as one video or animated image')
+    p.add_argument('input', help='file, or directory sent as one archive')
+    p.add_argument('-o', '--output', required=True,
+                   help='movie file, the format by extension: %s' %
+                        ', '.join(export.FORMATS))
+    p.add_argument('--fps', type=float, default=10,
+                   help='frames per second of the movie')
+    p.add_argument('--box-size', type=int, default=4,
+                   help='pixels per QR module')
+    p.add_argument('--count', type=int, default=0,
+                   help='symbols to write in fountain mode, '
+                        'twice the block count by default')
+    p.add_argument('--color', action='store_true',
+                   help='three frames per image, one in each rgb channel')
+    p.add_argument('--ack', metavar='IMAGE',
+                   help='write only the frames missing in the receiver '
+                        'acknowledgement shown in IMAGE')
+    p.add_argument('-j', '--processes', type=int,
+                   help='render processes, one per CPU by default')
+    add_frame_options(p)
+    p.set_defaults(func=cmd_export)
+
+    p = commands.add_parser('decode',
+                            help='decode a recorded video or image directory')
+    p.add_argument('input', help='video file or directory of images')
+    p.add_argument('-o', '--output',
+                   help='output file, or directory for an archive, the '
+                        'sent name by default')
+    p.add_argument('-j', '--processes', type=int,
+                   help='scanner processes, one per CPU by default')
+    p.add_argument('--step', type=int, default=1,
+                   help='scan every n-th image only')
+    p.add_argument('--color', action='store_true',
+                   help='images carry a symbol in each rgb channel')
+    p.add_argument('--crosstalk', type=float, default=0.0,
+                   help='simulate channel crosstalk, fraction of each '
+                        'channel leaking into the others')
+    p.add_argument('--ack', metavar='IMAGE',
+                   help='when frames are missing, write an acknowledgement '
+                        'code for "encode --ack" to IMAGE')
+    p.set_defaults(func=cmd_decode)
+
+    p = commands.add_parser('bench', help='benchmarks')
+    p.add_argument('target', nargs='?', default='render',
+                   choices=['render', 'receiver', 'matrix'],
+                   help='render: per frame render cost by QR version, '
+                        'receiver: reassembly of a large transfer, fails when '
+                        'the scanner\'s queries exceed their time limits, '
+                        'matrix: every stage over a settings matrix, '
+                        'as JSON')
+    p.add_argument('--frames', type=int, default=100000,
+                   help='frames of the receiver benchmark')
+    p.add_argument('--versions', default='1,5,10,15,20,25,30,35,40',
+                   help='comma separated QR versions')
+    p.add_argument('--box-size', type=int, default=5)
+    p.add_argument('--repeat', type=int, default=10)
+    p.add_argument('--ecc-levels', help='comma separated, all by default')
+    p.add_argument('--box-sizes', help='comma separated pixels per module')
+    p.add_argument('--frame-sizes', help='comma separated frame sizes')
+    p.add_argument('--payloads',
+                   help='comma separated: text, base64, binary, '
+                        'compressible')
+    p.add_argument('--case-frames', type=int, default=20,
+                   help='frames of data in every matrix case')
+    p.add_argument('-o', '--output', help='JSON file, stdout by default')
+    p.set_defaults(func=cmd_bench)
+
+    p = commands.add_parser(
+        'simulate', help='play the movie through a simulated camera')
+    p.add_argument('input')
+    p.add_argument('--box-size', type=int, default=3,
+                   help='pixels per QR module')
+    p.add_argument('--fps', type=float, default=10,
+                   help='player frame rate, for the reported times')
+    p.add_argument('--blur', type=float, default=0.0,
+                   help='gaussian blur radius in pixels')
+    p.add_argument('--perspective', type=float, default=0.0,
+                   help='corner displacement, fraction of the image size')
+    p.add_argument('--noise', type=float, default=0.0,
+                   help='sensor noise standard deviation, 0-255')
+    p.add_argument('--overlap', type=float, default=0.0,
+                   help='fraction of the previous frame in each capture')
+    p.add_argument('--drop', type=float, default=0.0,
+                   help='probability of a lost capture')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--max-loops', type=int, default=10,
+                   help='give up after this many loops of the movie')
+    p.add_argument('--json', action='store_true',
+                   help='print the result as JSON')
+    add_frame_options(p)
+    p.set_defaults(func=cmd_simulate)
+
+    return parser
+
+
+def main(argv):
+    args = make_parser().parse_args(argv)
+    return args.func(args)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Compression codecs. The codec id travels in the compact session header,
+# text frames only know zlib (the ZIP_* source types).
+#
+# The codec is chosen by compressing a sample of the input with every
+# candidate and keeping the one that needs the fewest frames, the faster
+# one on a tie.
+#
+# With CODEC_BLOCKS set on the codec id the stream is a run of blocks
+# compressed independently, so they are compressed on all cores and each
+# one is decompressed as soon as its frames are in:
+#
+#   varint raw length, varint compressed length, 4 byte crc32 of the raw
+#   data, compressed data (the raw data itself when the lengths are equal)
+
+import bz2
+import zlib
+import struct
+import multiprocessing
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+import constants as const
+from protocol import pack_varint, unpack_varint, crc32
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_BZ2 = 2
+CODEC_LZMA = 3
+CODEC_BLOCKS = 0x10
+
+CODEC_NAMES = {
+    CODEC_NONE: 'none',
+    CODEC_ZLIB: 'zlib',
+    CODEC_BZ2: 'bz2',
+    CODEC_LZMA: 'lzma',
+}
+
+# (codec, level), fastest first
+ZLIB_CANDIDATES = [(CODEC_ZLIB, 1), (CODEC_ZLIB, 6), (CODEC_ZLIB, 9)]
+CANDIDATES = ZLIB_CANDIDATES + [(CODEC_BZ2, 9)]
+if lzma:
+    CANDIDATES.append((CODEC_LZMA, 6))
+
+# bytes read from the start, middle and end of a file for the sample
+SAMPLE_CHUNK = 256 * 1024
+
+# a candidate at most this much larger than the smallest output still wins
+# when it is faster
+NEAR_TIE = 0.01
+
+
+def compressor(codec, level):
+    # object with compress(data) and flush()
+    if codec == CODEC_ZLIB:
+        return zlib.compressobj(level)
+    if codec == CODEC_BZ2:
+        return bz2.BZ2Compressor(level)
+    if codec == CODEC_LZMA:
+        return lzma.LZMACompressor(preset=level)
+    raise ValueError("unknown codec %d" % codec)
+
+
+def compress(codec, level, data):
+    c = compressor(codec, level)
+    return c.compress(data) + c.flush()
+
+
+def decompress(codec, data):
+    # raises ValueError for a stream that does not decode
+    if codec & CODEC_BLOCKS:
+        out = []
+        pos = 0
+        while pos < len(data):
+            raw, pos = unpack_block(codec, data, pos)
+            out.append(raw)
+        return b''.join(out)
+    try:
+        if codec == CODEC_ZLIB:
+            return zlib.decompress(data)
+        if codec == CODEC_BZ2:
+            return bz2.decompress(data)
+        if codec == CODEC_LZMA and lzma:
+            return lzma.decompress(data)
+    except Exception as e:
+        raise ValueError("%s: %s" % (CODEC_NAMES[codec], e))
+    raise ValueError("unsupported codec %d" % codec)
+
+
+def pack_block(codec, level, data):
+    body = compress(codec & ~CODEC_BLOCKS, level, data)
+    if len(body) >= len(data):
+        body = data
+    return b''.join([pack_varint(len(data)), pack_varint(len(body)),
+                     struct.pack('>I', crc32(data)), body])
+
+
+def block_end(data, pos):
+    # end offset of the block starting at pos, ValueError while the header
+    # is incomplete
+    raw_length, pos = unpack_varint(data, pos)
+    body_length, pos = unpack_varint(data, pos)
+    return pos + 4 + body_length
+
+
+def unpack_block(codec, data, pos):
+    # (raw data, end offset) of the block starting at pos
+    raw_length, pos = unpack_varint(data, pos)
+    body_length, pos = unpack_varint(data, pos)
+    if pos + 4 + body_length > len(data):
+        raise ValueError("truncated block")
+    crc = struct.unpack('>I', data[pos:pos + 4])[0]
+    body = data[pos + 4:pos + 4 + body_length]
+    if body_length == raw_length:
+        raw = body
+    else:
+        raw = decompress(codec & ~CODEC_BLOCKS, body)
+    if len(raw) != raw_length or crc32(raw) != crc:
+        raise ValueError("bad block checksum")
+    return raw, pos + 4 + body_length
+
+
+def _pack_block(job):
+    return pack_block(*job)
+
+
+def compress_blocks(chunks, codec, level, processes=None):
+    # yields the blocks of the chunks in order. Chunks are taken a batch at
+    # a time, so memory stays bounded, and a single batch is compressed
+    # without starting worker processes.
+    processes = processes or multiprocessing.cpu_count()
+    pool = None
+    batch = []
+    try:
+        for chunk in chunks:
+            batch.append((codec, level, chunk))
+            if len(batch) == processes * 2:
+                pool = pool or multiprocessing.Pool(processes)
+                for block in pool.map(_pack_block, batch):
+                    yield block
+                batch = []
+        for block in (pool.map if pool else map)(_pack_block, batch):
+            yield block
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+
+
+def sample(fh, size):
+    # leaves fh at the start of the file
+    if size <= SAMPLE_CHUNK * 3:
+        positions = [0]
+        chunk = size
+    else:
+        positions = [0, size // 2, size - SAMPLE_CHUNK]
+        chunk = SAMPLE_CHUNK
+    parts = []
+    for pos in positions:
+        fh.seek(pos)
+        parts.append(fh.read(chunk))
+    fh.seek(0)
+    return b''.join(parts)
+
+
+def choose_codec(data, candidates=CANDIDATES):
+    # (codec, level) for the sample data, (CODEC_NONE, 0) when compression
+    # does not save enough. The smallest output wins, the fastest candidate
+    # only when the sizes are nearly equal.
+    sizes = [(len(compress(codec, level, data)), (codec, level))
+             for codec, level in candidates]
+    limit = len(data) * const.ZIP_RATIO_THRESHOLD
+    smallest = min([size for size, _ in sizes] + [limit])
+    for size, candidate in sizes:
+        if size < limit and size <= smallest * (1 + NEAR_TIE):
+            return candidate
+    return (CODEC_NONE, 0)
@@ -17,11 +17,36 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+from os.path import expanduser, join
+
 # constants
-MAX_FILE_SIZE = 2 * 1000 * 1000
+MAX_FILE_SIZE = 1000 * 1000 * 1000
+# files opened into the text editor are read whole
+MAX_TEXT_SIZE = 2 * 1000 * 1000
+STREAM_CHUNK_SIZE = 1024 * 1024
 TYPE_RAW_TEXT = 0
 TYPE_BASE64_FILE = 1
 TYPE_ZIP_BASE64_FILE = 2
+TYPE_BINARY_FILE = 3
+TYPE_ZIP_BINARY_FILE = 4
+TYPE_BASE64_ARCHIVE = 5
+TYPE_ZIP_BASE64_ARCHIVE = 6
+TYPE_BINARY_ARCHIVE = 7
+TYPE_ZIP_BINARY_ARCHIVE = 8
+BASE64_TYPES = (TYPE_BASE64_FILE, TYPE_ZIP_BASE64_FILE,
+                TYPE_BASE64_ARCHIVE, TYPE_ZIP_BASE64_ARCHIVE)
+BINARY_TYPES = (TYPE_BINARY_FILE, TYPE_ZIP_BINARY_FILE,
+                TYPE_BINARY_ARCHIVE, TYPE_ZIP_BINARY_ARCHIVE)
+ZIP_TYPES = (TYPE_ZIP_BASE64_FILE, TYPE_ZIP_BINARY_FILE,
+             TYPE_ZIP_BASE64_ARCHIVE, TYPE_ZIP_BINARY_ARCHIVE)
+ARCHIVE_TYPES = (TYPE_BASE64_ARCHIVE, TYPE_ZIP_BASE64_ARCHIVE,
+                 TYPE_BINARY_ARCHIVE, TYPE_ZIP_BINARY_ARCHIVE)
 ZIP_RATIO_THRESHOLD = 0.9
 
+# seconds between scanner progress refreshes
+UI_REFRESH_INTERVAL = 0.1
+
+# received frames of unfinished transfers, for resuming a scan
+JOURNAL_DIR = join(expanduser('~'), '.flipqr', 'journal')
+
 FLIPQR_VERSION = 0.1
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Offline decoding of a recorded FlipQR movie, a video file or a directory
+# of images. Images are scanned by a pool of worker processes with zbar's
+# image scanner and the symbols are fed, in recording order, to the same
+# Receiver the scanner dialog uses.
+#
+# Colour images carry one symbol in each of the red, green and blue
+# channels, they are split and every channel is scanned as a gray image.
+# A crosstalk amount simulates a camera that leaks part of each channel
+# into the other two.
+
+import os
+import time
+import multiprocessing
+from os.path import isdir, join, splitext
+
+from stats import Stats
+
+try:
+    import zbar
+except ImportError:
+    zbar = None
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff')
+
+_scanner = None
+_crosstalk = 0.0
+
+
+def init_worker(crosstalk=0.0):
+    global _scanner, _crosstalk
+    _crosstalk = crosstalk
+    _scanner = zbar.ImageScanner()
+    _scanner.parse_config('enable')
+    try:
+        _scanner.parse_config('qrcode.binary')
+    except Exception:
+        pass
+
+
+def scan_gray(job):
+    # job: (width, height, 8 bit gray pixels), returns the symbol data
+    width, height, pixels = job
+    image = zbar.Image(width, height, 'Y800', pixels)
+    _scanner.scan(image)
+    return [str(symbol.data) for symbol in image]
+
+
+def mix_channels(width, height, pixels, amount):
+    keep = 1.0 - 2 * amount
+    image = Image.frombytes('RGB', (width, height), pixels)
+    image = image.convert('RGB', (keep, amount, amount, 0,
+                                  amount, keep, amount, 0,
+                                  amount, amount, keep, 0))
+    return image.tobytes()
+
+
+def scan_rgb(job):
+    # job: (width, height, 24 bit rgb pixels), channels in order
+    width, height, pixels = job
+    if _crosstalk:
+        pixels = mix_channels(width, height, pixels, _crosstalk)
+    found = []
+    for channel in range(3):
+        found += scan_gray((width, height, pixels[channel::3]))
+    return found
+
+
+def load_image(path, mode):
+    image = Image.open(path).convert(mode)
+    pixels = image.tobytes() if hasattr(image, 'tobytes') \
+        else image.tostring()
+    return image.size[0], image.size[1], pixels
+
+
+def scan_file(path):
+    try:
+        job = load_image(path, 'L')
+    except IOError:
+        return []
+    return scan_gray(job)
+
+
+def scan_color_file(path):
+    try:
+        job = load_image(path, 'RGB')
+    except IOError:
+        return []
+    return scan_rgb(job)
+
+
+def image_files(directory):
+    return sorted([join(directory, name) for name in os.listdir(directory)
+                   if splitext(name)[1].lower() in IMAGE_EXTENSIONS])
+
+
+def video_frames(path, step=1, color=False):
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise IOError("%s: cannot open video" % path)
+    number = 0
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            if number % step == 0:
+                if color:
+                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                else:
+                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                yield frame.shape[1], frame.shape[0], frame.tostring()
+            number += 1
+    finally:
+        capture.release()
+
+
+def open_input(path, step=1, color=False):
+    # (worker function, jobs) for a directory of images or a video file
+    if zbar is None:
+        raise ImportError("decoding needs the zbar python module")
+    if isdir(path):
+        if Image is None:
+            raise ImportError("decoding images needs PIL (Pillow)")
+        worker = scan_color_file if color else scan_file
+        return worker, image_files(path)[::step]
+    if cv2 is None:
+        raise ImportError("decoding video needs OpenCV (cv2)")
+    return scan_rgb if color else scan_gray, video_frames(path, step, color)
+
+
+def timed_scan(job):
+    # (seconds, symbols) of worker(image)
+    worker, image = job
+    started = time.time()
+    found = worker(image)
+    return time.time() - started, found
+
+
+def decode(worker, jobs, receiver, processes=None, progress=None,
+           crosstalk=0.0, stats=None):
+    # feeds every symbol to receiver until it is done, returns the counts
+    if crosstalk and Image is None:
+        raise ImportError("the crosstalk simulation needs PIL (Pillow)")
+    stats = stats or Stats('decoder')
+    pool = multiprocessing.Pool(processes, init_worker, (crosstalk,))
+    images = symbols = 0
+    started = time.time()
+    try:
+        for scan_seconds, found in pool.imap(
+                timed_scan, ((worker, job) for job in jobs), chunksize=4):
+            images += 1
+            stats.add('decode', scan_seconds)
+            with stats.stage('reassembly'):
+                for data in found:
+                    symbols += 1
+                    receiver.feed(data)
+                    if receiver.is_done:
+                        break
+            stats.log('image', number=images, symbols=len(found),
+                      decode_ms=scan_seconds * 1000)
+            if progress:
+                progress(images, receiver)
+            if receiver.is_done:
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+    seconds = time.time() - started
+    result = {
+        "images": images,
+        "symbols": symbols,
+        "seconds": seconds,
+        "images_per_second": images / max(seconds, 1e-6),
+        "duplicates": receiver.duplicates,
+        "rejected": receiver.rejected,
+        "unreadable": receiver.malformed,
+        "useful_bytes_per_second": receiver.useful_bytes / max(seconds, 1e-6),
+    }
+    for name, timer in stats.snapshot()["timers"].items():
+        result[name + "_ms"] = timer["mean_ms"]
+    stats.log('done', success=receiver.is_success, **result)
+    return result
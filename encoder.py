@@ -0,0 +1,673 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Qt free frame encoder, shared by the player dialog and the command line
+
+import zlib
+import base64
+import struct
+import hashlib
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+from os.path import basename, getsize
+from collections import namedtuple
+
+import qrcode
+from qrcode import util as qrutil
+import constants as const
+import protocol
+import merkle
+import archive
+import compression
+from fountain import LTEncoder
+from stream import FileData, Base64Data
+
+
+ECC_LEVELS = {
+    '7%': qrcode.constants.ERROR_CORRECT_L,
+    '15%': qrcode.constants.ERROR_CORRECT_M,
+    '25%': qrcode.constants.ERROR_CORRECT_Q,
+    '30%': qrcode.constants.ERROR_CORRECT_H
+}
+
+QR_BORDER = 4
+
+# fixed size fountain symbols reserve header room for seeds up to this
+MAX_SEED = 1 << 28
+
+MODE_FRAMES = 'frames'
+MODE_FOUNTAIN = 'fountain'
+
+# frames per image in colour mode, one symbol in each of red, green, blue
+CHANNELS = 3
+
+Frame = namedtuple('Frame', ['number', 'payload', 'matrix'])
+
+
+def text_source(text, binary=False):
+    encoded = text.encode('utf-8')
+    src_md5 = hashlib.md5(encoded).hexdigest()
+    source = {
+        "id": src_md5[0:6],
+        "data": text,
+        "type": const.TYPE_RAW_TEXT,
+        "md5": src_md5,
+        "binary": binary,
+    }
+    # text frames show plain text, only binary frames are compressed
+    if binary:
+        codec, level = compression.choose_codec(encoded)
+        if codec:
+            source["raw"] = compression.pack_block(codec, level, encoded)
+            source["codec"] = codec | compression.CODEC_BLOCKS
+            source["blocks"] = [0]
+    return source
+
+
+def read_chunks(fh, size, md5, progress=None):
+    done = 0
+    while True:
+        chunk = fh.read(const.STREAM_CHUNK_SIZE)
+        if not chunk:
+            return
+        md5.update(chunk)
+        done += len(chunk)
+        if progress:
+            progress(done, size)
+        yield chunk
+
+
+# source types by (compressed, binary, archive)
+SOURCE_TYPES = {
+    (False, False, False): const.TYPE_BASE64_FILE,
+    (True, False, False): const.TYPE_ZIP_BASE64_FILE,
+    (False, True, False): const.TYPE_BINARY_FILE,
+    (True, True, False): const.TYPE_ZIP_BINARY_FILE,
+    (False, False, True): const.TYPE_BASE64_ARCHIVE,
+    (True, False, True): const.TYPE_ZIP_BASE64_ARCHIVE,
+    (False, True, True): const.TYPE_BINARY_ARCHIVE,
+    (True, True, True): const.TYPE_ZIP_BINARY_ARCHIVE,
+}
+
+
+def file_source(filename, binary=False, progress=None):
+    size = getsize(filename)
+    if not size:
+        return None
+    return stream_source(open(filename, "rb"), size, basename(filename),
+                         binary, progress)
+
+
+def folder_source(directory, binary=False, progress=None):
+    # every file below directory in one archive.Archive stream, hashing the
+    # files and spooling the stream each report progress from 0 to size
+    container = archive.Archive(directory, progress)
+    if not container.paths:
+        return None
+    return stream_source(container, len(container),
+                         basename(directory.rstrip('/\\')), binary,
+                         progress, is_archive=True)
+
+
+def stream_source(fh, size, filename, binary=False, progress=None,
+                  is_archive=False):
+    # one streaming pass hashes the file and spools the compressed stream
+    # to a temporary file, frames are later read from disk on demand.
+    # Text frames only know a single zlib stream, binary frames may use any
+    # codec and compress independent blocks of STREAM_CHUNK_SIZE bytes on
+    # all cores.
+    codec, level = compression.choose_codec(
+        compression.sample(fh, size),
+        compression.CANDIDATES if binary else compression.ZLIB_CANDIDATES)
+    md5 = hashlib.md5()
+    chunks = read_chunks(fh, size, md5, progress)
+    spool = tempfile.TemporaryFile()
+    blocks = []
+    if codec and binary:
+        codec |= compression.CODEC_BLOCKS
+        for block in compression.compress_blocks(chunks, codec, level):
+            blocks.append(spool.tell())
+            spool.write(block)
+    elif codec:
+        compressor = compression.compressor(codec, level)
+        for chunk in chunks:
+            spool.write(compressor.compress(chunk))
+        spool.write(compressor.flush())
+    else:
+        for chunk in chunks:
+            pass
+    src_md5 = md5.hexdigest()
+
+    # the sample may promise more than the whole file gives
+    if codec and float(spool.tell()) / size < const.ZIP_RATIO_THRESHOLD:
+        fh.close()
+        raw = FileData(spool, 0, spool.tell())
+    else:
+        spool.close()
+        codec = compression.CODEC_NONE
+        blocks = []
+        raw = FileData(fh, 0, size)
+    src_type = SOURCE_TYPES[(bool(codec), bool(binary), is_archive)]
+
+    # binary sources put the raw bytes straight into QR byte mode
+    return {
+        "id": src_md5[0:6],
+        "data": raw if binary else Base64Data(raw),
+        "raw": raw,
+        "type": src_type,
+        "md5": src_md5,
+        "filename": filename,
+        "binary": binary,
+        "codec": codec,
+        "blocks": blocks,
+    }
+
+
+def source_bytes(source):
+    # the bytes the receiver ends up with, before base64 or text decoding
+    if 'raw' in source:
+        return source['raw']
+    if source['type'] == const.TYPE_RAW_TEXT:
+        return source['data'].encode('utf-8')
+    if source['type'] in const.BASE64_TYPES:
+        return base64.b64decode(source['data'])
+    return source['data']
+
+
+def byte_capacity(version, ecc):
+    # bytes of a single byte mode segment that fit the symbol
+    bits = qrutil.BIT_LIMIT_TABLE[ecc][version]
+    bits -= 4 + qrutil.length_in_bits(qrutil.MODE_8BIT_BYTE, version)
+    return bits // 8
+
+
+class FrameBounds(object):
+
+    # frame start offsets as runs of evenly spaced frames: index of the
+    # first frame, its offset and the spacing of every run in flat arrays,
+    # so a layout costs memory per run rather than per frame
+
+    def __init__(self):
+        self.firsts = array('l')
+        self.starts = array('l')
+        self.steps = array('l')
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError("frame index out of range")
+        run = bisect_right(self.firsts, index) - 1
+        return self.starts[run] + (index - self.firsts[run]) * self.steps[run]
+
+    def add(self, start, step=0, count=1):
+        # count frames from offset start, step apart
+        if self.count:
+            first, last = self.firsts[-1], self.starts[-1]
+            if self.count - first == 1:
+                # a single frame continues as a run of any spacing
+                if count == 1 or step == start - last:
+                    self.steps[-1] = start - last
+                    self.count += count
+                    return
+            elif start == last + (self.count - first) * self.steps[-1] \
+                    and (count == 1 or step == self.steps[-1]):
+                self.count += count
+                return
+        self.firsts.append(self.count)
+        self.starts.append(start)
+        self.steps.append(step)
+        self.count += count
+
+
+class FrameEncoder(object):
+
+    # binary sources use compact headers and slice the raw bytes, the
+    # others keep the text header and slice source['data'].
+    #
+    # With a fixed QR version every frame is filled up to the byte
+    # capacity of that version, otherwise the data is cut every
+    # frame_size characters and the smallest fitting version is used.
+    #
+    # Compact frames also carry a hash tree over the data, every
+    # protocol.LEAF_FRAMES frames form one leaf.
+
+    endless = False
+    tree = None
+
+    def __init__(self, source, frame_size, ecc='7%', version=None):
+        self.source = source
+        self.frame_size = int(frame_size)
+        self.ecc = ECC_LEVELS[ecc]
+        self.version = version
+        self.compact = source.get('binary', False)
+        self.data = source_bytes(source) if self.compact else source['data']
+        self.meta = protocol.make_meta(source, len(self.data))
+        if self.compact:
+            # the root depends on the layout, reserve its room first
+            self.meta["tree"] = (merkle.DEFAULT_ALGO, protocol.LEAF_FRAMES,
+                                 b'\x00' * merkle.HASH_SIZE)
+
+        if version:
+            capacity = byte_capacity(version, self.ecc)
+            self.is_static = (
+                source['type'] == const.TYPE_RAW_TEXT and
+                len(source_bytes(source)) <= capacity)
+            self.bounds = self.layout(capacity)
+        else:
+            self.is_static = self.frame_size >= len(self.data)
+            self.bounds = FrameBounds()
+            self.bounds.add(0, self.frame_size, max(
+                (len(self.data) + self.frame_size - 1) // self.frame_size, 1))
+        self.total_frames = len(self.bounds)
+
+        if self.compact:
+            self.tree = merkle.build_tree(merkle.DEFAULT_ALGO,
+                                          self.leafCount(), self.leafData)
+            self.meta["tree"] = (merkle.DEFAULT_ALGO, protocol.LEAF_FRAMES,
+                                 self.tree.root)
+
+    def __len__(self):
+        return self.total_frames
+
+    def __iter__(self):
+        for number in range(1, self.total_frames + 1):
+            yield self.frame(number)
+
+    def leafCount(self, total=None):
+        total = total or self.total_frames
+        return (total + protocol.LEAF_FRAMES - 1) // protocol.LEAF_FRAMES
+
+    def frameRange(self, number):
+        # data offsets of a frame
+        end = self.bounds[number] if number < self.total_frames \
+            else len(self.data)
+        return self.bounds[number - 1], end
+
+    def leafData(self, leaf):
+        first = leaf * protocol.LEAF_FRAMES + 1
+        last = min(first + protocol.LEAF_FRAMES - 1, self.total_frames)
+        return self.data[self.frameRange(first)[0]:self.frameRange(last)[1]]
+
+    def leaf(self, number, total=None):
+        # (leaf hash, proof) carried by the first frame of every leaf,
+        # zero filled while the layout is worked out
+        if not self.compact or (number - 1) % protocol.LEAF_FRAMES:
+            return None
+        index = (number - 1) // protocol.LEAF_FRAMES
+        if self.tree is None:
+            zero = b'\x00' * merkle.HASH_SIZE
+            depth = merkle.proof_length(self.leafCount(total))
+            return zero, [zero] * depth
+        return self.tree.leaf(index), self.tree.proof(index)
+
+    def blockStart(self, start, end):
+        # distance from start to the first compressed block starting
+        # before end, see compression.CODEC_BLOCKS
+        blocks = self.source.get('blocks') or []
+        i = bisect_left(blocks, start)
+        if i < len(blocks) and blocks[i] < end:
+            return blocks[i] - start
+        return None
+
+    def headerParts(self, total, capacity):
+        # (bytes in every header, extra bytes on frame 1, extra bytes on
+        # the first frame of a leaf); the frame number, offset and block
+        # distance fields are sized per frame by layout
+        session = self.source["id"]
+        if self.compact:
+            # the payload length varint is sized for a full frame
+            plain = protocol.pack_header(session, 0, total, 0, capacity)
+            meta = protocol.pack_header(session, 0, total, 0, capacity,
+                                        meta=self.meta)
+            leaf = protocol.pack_header(session, 0, total, 0, capacity,
+                                        leaf=self.leaf(1, total))
+            # without the one byte number and offset varints
+            return (len(plain) - 2 + protocol.CRC_SIZE,
+                    len(meta) - len(plain), len(leaf) - len(plain))
+        plain = protocol.text_frame(session, 1, total, b'')
+        meta = protocol.text_frame(session, 1, total, b'', self.meta)
+        # without the one digit frame number
+        return len(plain) - 1, len(meta) - len(plain), 0
+
+    def advance(self, pos, room):
+        if self.compact or self.source['type'] != const.TYPE_RAW_TEXT:
+            return min(len(self.data), pos + room)
+        # utf-8 text, never split a character between frames
+        end = pos
+        while end < len(self.data):
+            room -= len(self.data[end].encode('utf-8'))
+            if room < 0:
+                break
+            end += 1
+        return end
+
+    def layout(self, capacity):
+        # frame start offsets, the header size depends on the total frame
+        # count, so repeat until the count is stable
+        total = 1
+        while True:
+            bounds = self.frameStarts(total, capacity)
+            if len(bounds) <= total:
+                return bounds
+            total = len(bounds)
+
+    def frameStarts(self, total, capacity):
+        # headers are sized from their fields. Only frame 1, the first
+        # frame of a leaf and frames where a compressed block starts carry
+        # extra fields, the frames between them are alike until the frame
+        # number or the offset needs another digit or varint byte, so such
+        # runs are laid out in one step.
+        varint_size = protocol.varint_size
+        fixed, first, leaf = self.headerParts(total, capacity)
+        size = len(self.data)
+        linear = self.compact or self.source['type'] != const.TYPE_RAW_TEXT
+        blocks = self.source.get('blocks') or []
+        bounds = FrameBounds()
+        pos = 0
+        while pos < size or not bounds:
+            number = len(bounds) + 1
+            start = pos
+            header = fixed
+            if number == 1:
+                header += first
+            block = None
+            if self.compact:
+                header += varint_size(number) + varint_size(pos)
+                if (number - 1) % protocol.LEAF_FRAMES == 0:
+                    header += leaf
+                block = self.blockStart(pos, pos + capacity)
+                if block is not None:
+                    header += varint_size(block)
+            else:
+                header += len(str(number))
+            room = capacity - header
+            pos = self.advance(start, max(room, 0))
+            if pos == start and start < size:
+                raise ValueError("QR version too small for the header")
+            bounds.add(start)
+
+            if not linear or number == 1 or block is not None or (
+                    self.compact and
+                    (number - 1) % protocol.LEAF_FRAMES == 0):
+                continue
+            # the frames after this one with the same header
+            run = (size - pos + room - 1) // room
+            if self.compact:
+                next_leaf = ((number - 1) // protocol.LEAF_FRAMES + 1) * \
+                    protocol.LEAF_FRAMES + 1
+                run = min(run, next_leaf - number - 1,
+                          (1 << 7 * varint_size(number)) - number - 1,
+                          ((1 << 7 * varint_size(start)) - pos + room - 1) //
+                          room)
+                i = bisect_left(blocks, pos)
+                if i < len(blocks):
+                    run = min(run, max(0, (blocks[i] - capacity - pos) //
+                                       room + 1))
+            else:
+                run = min(run, 10 ** len(str(number)) - number - 1)
+            if run > 0:
+                bounds.add(pos, room, run)
+                pos += run * room
+        return bounds
+
+    def payload(self, number):
+        data = self.data
+        if self.is_static and self.source['type'] == const.TYPE_RAW_TEXT \
+                and not self.source.get('codec'):
+            return source_bytes(self.source)
+
+        from_, to = self.frameRange(number)
+        chunk = data[from_:to]
+        meta = self.meta if number == 1 else None
+        if self.compact:
+            return protocol.pack_frame(self.source["id"], number,
+                                       self.total_frames, from_, chunk,
+                                       meta=meta, leaf=self.leaf(number),
+                                       block=self.blockStart(from_, to))
+
+        if self.source['type'] == const.TYPE_RAW_TEXT:
+            chunk = chunk.encode('utf-8')
+        return protocol.text_frame(self.source["id"], number,
+                                   self.total_frames, chunk, meta)
+
+    def qrcode(self, number, box_size=1, image_factory=None, version=None):
+        return make_qrcode(self.payload(number), self.ecc,
+                           self.version or version, bool(self.version),
+                           box_size, image_factory)
+
+    def matrix(self, number):
+        return self.qrcode(number).modules
+
+    def matrices(self, numbers):
+        # symbols of one size for frames that share an image, the smaller
+        # ones are made again at the largest version
+        qrs = [self.qrcode(n) for n in numbers]
+        version = max(qr.version for qr in qrs)
+        return [qr.modules if qr.version == version
+                else self.qrcode(n, version=version).modules
+                for n, qr in zip(numbers, qrs)]
+
+    def frame(self, number):
+        qr = self.qrcode(number)
+        return Frame(number, self.payload(number), qr.modules)
+
+
+class FountainEncoder(FrameEncoder):
+
+    # endless stream of LT symbols, frame number n carries seed n - 1,
+    # total_frames is the number of source blocks
+
+    endless = True
+    is_static = False
+
+    def __init__(self, source, frame_size, ecc='7%', version=None):
+        self.source = source
+        self.frame_size = int(frame_size)
+        self.ecc = ECC_LEVELS[ecc]
+        self.version = version
+        self.compact = source.get('binary', False)
+        data = source_bytes(source)
+        self.meta = protocol.make_meta(source, len(data))
+        # symbols sized for a fixed QR version leave no room for the meta
+        # block, it is sent in frames of its own instead of some symbols
+        self.meta_frames = self.compact and bool(version)
+        if version:
+            self.frame_size = self.symbolSize(byte_capacity(version, self.ecc))
+        self.lt = LTEncoder(data, self.frame_size)
+        self.total_frames = self.lt.k
+        # a meta frame takes the place of a symbol, so they are at least as
+        # far apart as the symbols that the meta block would fill. With
+        # many blocks they are rarer, a receiver still sees several of them
+        # while it collects the blocks.
+        self.meta_interval = protocol.META_INTERVAL
+        if self.meta_frames:
+            self.meta_interval = max(
+                protocol.META_INTERVAL,
+                self.frame_size // self.metaSize() + 1,
+                self.total_frames // protocol.META_INTERVAL)
+
+    def metaSize(self):
+        # bytes the meta block adds to a compact header
+        return len(protocol.pack_header(
+            self.source["id"], 0, 0, 0, 0, fountain=True,
+            meta=self.meta)) - len(protocol.pack_header(
+                self.source["id"], 0, 0, 0, 0, fountain=True))
+
+    def symbolSize(self, capacity):
+        # all symbols have the same size, leave room for the largest header
+        if self.compact:
+            header = len(protocol.pack_header(
+                self.source["id"], MAX_SEED, MAX_SEED, 0, capacity,
+                fountain=True))
+            size = capacity - header - protocol.CRC_SIZE
+            if size < self.metaSize():
+                # a meta frame would not fit
+                size = 0
+        else:
+            header = len(protocol.text_symbol(
+                self.source["id"], MAX_SEED, MAX_SEED, b'', self.meta))
+            size = capacity - header
+            if self.source['type'] not in const.BINARY_TYPES:
+                size = size // 4 * 3
+        if size <= 0:
+            raise ValueError("QR version too small for the header")
+        return size
+
+    def __iter__(self):
+        number = 1
+        while True:
+            yield self.frame(number)
+            number += 1
+
+    def payload(self, number):
+        seed = number - 1
+        meta = seed % self.meta_interval == 0
+        if self.meta_frames and meta:
+            return protocol.pack_frame(self.source["id"], seed,
+                                       self.total_frames, 0, b'',
+                                       fountain=True, meta=self.meta)
+        symbol = self.lt.symbol(seed)
+        if self.compact:
+            return protocol.pack_frame(self.source["id"], seed,
+                                       self.total_frames, 0, symbol,
+                                       fountain=True,
+                                       meta=self.meta if meta and
+                                       not self.meta_frames else None)
+        return protocol.text_symbol(self.source["id"], seed,
+                                    self.total_frames, symbol, self.meta)
+
+
+def make_qrcode(payload, ecc, version=None, byte_mode=False, box_size=1,
+                image_factory=None):
+    # byte_mode: a single byte mode segment at the given version, as
+    # assumed by byte_capacity. Otherwise the smallest fitting version
+    # is used, or the given one.
+    qr = qrcode.QRCode(
+        version=version,
+        error_correction=ecc,
+        box_size=box_size,
+        border=QR_BORDER,
+        image_factory=image_factory
+    )
+    if byte_mode:
+        qr.add_data(qrutil.QRData(payload, mode=qrutil.MODE_8BIT_BYTE))
+        qr.make(fit=False)
+    else:
+        qr.add_data(payload)
+        qr.make(fit=version is None)
+    return qr
+
+
+def make_encoder(source, frame_size, ecc='7%', mode=MODE_FRAMES,
+                 version=None):
+    if mode == MODE_FOUNTAIN:
+        return FountainEncoder(source, frame_size, ecc, version)
+    return FrameEncoder(source, frame_size, ecc, version)
+
+
+def scanlines(matrix, box_size, border=QR_BORDER):
+    # 8 bit grayscale rows of the scaled symbol, dark modules are 0
+    dark = b'\x00' * box_size
+    light = b'\xff' * box_size
+    edge = light * border
+    quiet = light * (len(matrix) + border * 2)
+
+    for i in range(border * box_size):
+        yield quiet
+    for row in matrix:
+        line = edge + b''.join([dark if m else light for m in row]) + edge
+        for i in range(box_size):
+            yield line
+    for i in range(border * box_size):
+        yield quiet
+
+
+# rgb pixels by dark modules, bit 0 red, bit 1 green, bit 2 blue
+_CHANNEL_PIXELS = [b''.join([b'\x00' if bits & (1 << c) else b'\xff'
+                             for c in range(CHANNELS)])
+                   for bits in range(1 << CHANNELS)]
+
+
+def color_scanlines(matrices, box_size, border=QR_BORDER):
+    # 24 bit rgb rows, symbol i drawn in channel i, missing symbols are
+    # left light. The symbols must have the same size.
+    pixels = [p * box_size for p in _CHANNEL_PIXELS]
+    width = len(matrices[0])
+    quiet = pixels[0] * (width + border * 2)
+    edge = pixels[0] * border
+
+    for i in range(border * box_size):
+        yield quiet
+    for rows in zip(*matrices):
+        line = edge + b''.join([
+            pixels[sum([1 << c for c, row in enumerate(rows) if row[col]])]
+            for col in range(width)]) + edge
+        for i in range(box_size):
+            yield line
+    for i in range(border * box_size):
+        yield quiet
+
+
+def _png_chunk(tag, data):
+    chunk = tag + data
+    return (struct.pack('>I', len(data)) + chunk +
+            struct.pack('>I', zlib.crc32(chunk) & 0xffffffff))
+
+
+def _png(size, color_type, lines):
+    raw = b''.join([b'\x00' + line for line in lines])
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        _png_chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8,
+                                        color_type, 0, 0, 0)),
+        _png_chunk(b'IDAT', zlib.compress(raw, 9)),
+        _png_chunk(b'IEND', b''),
+    ])
+
+
+def gray_pixels(matrix, box_size, border=QR_BORDER):
+    # (width, height, 8 bit pixels) of the symbol, zbar's Y800 input
+    size = (len(matrix) + border * 2) * box_size
+    return size, size, b''.join(scanlines(matrix, box_size, border))
+
+
+def png_bytes(matrix, box_size, border=QR_BORDER):
+    size = (len(matrix) + border * 2) * box_size
+    return _png(size, 0, scanlines(matrix, box_size, border))
+
+
+def color_png_bytes(matrices, box_size, border=QR_BORDER):
+    size = (len(matrices[0]) + border * 2) * box_size
+    return _png(size, 2, color_scanlines(matrices, box_size, border))
+
+
+def write_png(filename, matrix, box_size, border=QR_BORDER):
+    fh = open(filename, 'wb')
+    fh.write(png_bytes(matrix, box_size, border))
+    fh.close()
+
+
+def write_color_png(filename, matrices, box_size, border=QR_BORDER):
+    fh = open(filename, 'wb')
+    fh.write(color_png_bytes(matrices, box_size, border))
+    fh.close()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Writes the QR movie to a file any media player can show. Animated PNG is
+# written here, every other format goes through an ffmpeg pipe as raw
+# frames.
+#
+# The payloads are made in this process, the symbols are encoded and
+# rendered (and for animated PNG also compressed) by a pool of worker
+# processes a batch at a time, so memory stays bounded however long the
+# movie is. A first pass over the payloads finds the largest QR version,
+# every frame is then made at that version so all images have one size.
+
+import zlib
+import struct
+import subprocess
+import multiprocessing
+from distutils.spawn import find_executable
+from os.path import splitext
+
+import qrcode
+
+from encoder import make_qrcode, scanlines, color_scanlines, _png_chunk, \
+    QR_BORDER, CHANNELS
+
+APNG_EXTENSIONS = ('.png', '.apng')
+
+# encoder options by file extension, lossless or close to it so the
+# modules stay sharp
+FFMPEG_OPTIONS = {
+    '.mp4': ['-c:v', 'libx264', '-preset', 'veryfast', '-tune',
+             'stillimage', '-crf', '10', '-pix_fmt', 'yuv420p'],
+    '.mkv': ['-c:v', 'libx264', '-preset', 'veryfast', '-qp', '0'],
+    '.webm': ['-c:v', 'libvpx-vp9', '-lossless', '1'],
+    '.avi': ['-c:v', 'mjpeg', '-q:v', '2', '-pix_fmt', 'yuvj444p'],
+    '.gif': ['-loop', '0'],
+}
+
+FORMATS = APNG_EXTENSIONS + tuple(sorted(FFMPEG_OPTIONS))
+
+
+def fit_version(job):
+    # smallest QR version of a payload
+    payload, ecc = job
+    qr = qrcode.QRCode(error_correction=ecc)
+    qr.add_data(payload)
+    return qr.best_fit()
+
+
+def render_image(job):
+    # the pixels of one image, rows padded to width and height; for
+    # animated PNG the compressed, filtered rows
+    payloads, ecc, version, byte_mode, box_size, color, size, png = job
+    matrices = [make_qrcode(payload, ecc, version, byte_mode).modules
+                for payload in payloads]
+    if color:
+        lines = color_scanlines(matrices, box_size)
+        pad = b'\xff' * 3
+    else:
+        lines = scanlines(matrices[0], box_size)
+        pad = b'\xff'
+    width, height = size
+    rows = []
+    for line in lines:
+        rows.append(line + pad * (width - len(line) // len(pad)))
+    rows += [pad * width] * (height - len(rows))
+    if png:
+        return zlib.compress(b''.join([b'\x00' + row for row in rows]), 6)
+    return b''.join(rows)
+
+
+class ApngWriter(object):
+
+    def __init__(self, filename, size, color, frames, fps):
+        self.fh = open(filename, 'wb')
+        self.size = size
+        self.sequence = 0
+        self.first = True
+        # delay of each frame in seconds, as a fraction
+        self.delay = (100, int(round(fps * 100)))
+        self.fh.write(b'\x89PNG\r\n\x1a\n')
+        self.fh.write(_png_chunk(b'IHDR', struct.pack(
+            '>IIBBBBB', size[0], size[1], 8, 2 if color else 0, 0, 0, 0)))
+        # frame count, loop forever
+        self.fh.write(_png_chunk(b'acTL', struct.pack('>II', frames, 0)))
+
+    def write(self, data):
+        self.fh.write(_png_chunk(b'fcTL', struct.pack(
+            '>IIIIIHHBB', self.sequence, self.size[0], self.size[1], 0, 0,
+            self.delay[0], self.delay[1], 0, 0)))
+        self.sequence += 1
+        if self.first:
+            # the first frame is also the default image
+            self.fh.write(_png_chunk(b'IDAT', data))
+            self.first = False
+        else:
+            self.fh.write(_png_chunk(
+                b'fdAT', struct.pack('>I', self.sequence) + data))
+            self.sequence += 1
+
+    def close(self):
+        self.fh.write(_png_chunk(b'IEND', b''))
+        self.fh.close()
+
+
+class FfmpegWriter(object):
+
+    def __init__(self, ffmpeg, filename, size, color, fps):
+        command = [ffmpeg, '-v', 'error', '-y',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgb24' if color else 'gray',
+                   '-s', '%dx%d' % size, '-r', str(fps), '-i', '-']
+        command += FFMPEG_OPTIONS[splitext(filename)[1].lower()]
+        self.process = subprocess.Popen(command + [filename],
+                                        stdin=subprocess.PIPE)
+
+    def write(self, data):
+        self.process.stdin.write(data)
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait():
+            raise IOError("ffmpeg failed with status %d" %
+                          self.process.returncode)
+
+
+def export(frames, filename, numbers, fps=10, box_size=4, color=False,
+           processes=None, progress=None):
+    # writes frames (an encoder from make_encoder) with the given numbers
+    # in order, returns the number of images
+    extension = splitext(filename)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError("unknown movie format %s, use one of %s" % (
+            extension, ', '.join(FORMATS)))
+    png = extension in APNG_EXTENSIONS
+    ffmpeg = None if png else find_executable('ffmpeg')
+    if not png and not ffmpeg:
+        raise IOError("exporting %s needs ffmpeg on the PATH" % extension)
+    channels = CHANNELS if color else 1
+    images = [numbers[i:i + channels]
+              for i in range(0, len(numbers), channels)]
+
+    processes = processes or multiprocessing.cpu_count()
+    batch = processes * 4
+    pool = multiprocessing.Pool(processes)
+    try:
+        version = frames.version
+        if not version:
+            for start in range(0, len(numbers), batch):
+                version = max([version] + pool.map(fit_version, [
+                    (frames.payload(n), frames.ecc)
+                    for n in numbers[start:start + batch]]))
+        side = (version * 4 + 17 + QR_BORDER * 2) * box_size
+        # yuv420p video wants even sizes
+        size = (side, side) if png else (side + side % 2, side + side % 2)
+
+        if png:
+            writer = ApngWriter(filename, size, color, len(images), fps)
+        else:
+            writer = FfmpegWriter(ffmpeg, filename, size, color, fps)
+        try:
+            for start in range(0, len(images), batch):
+                jobs = [([frames.payload(n) for n in shown], frames.ecc,
+                         version, bool(frames.version), box_size, color,
+                         size, png)
+                        for shown in images[start:start + batch]]
+                for data in pool.map(render_image, jobs):
+                    writer.write(data)
+                if progress:
+                    progress(min(start + batch, len(images)), len(images))
+        finally:
+            writer.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return len(images)
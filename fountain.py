@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# LT (Luby transform) fountain code.
+#
+# The data is cut into k blocks. Symbol seeds 0 .. k-1 carry the blocks
+# unchanged, every later seed is the xor of a random set of blocks whose
+# size follows the robust soliton distribution. Sender and receiver derive
+# the set from the seed alone, so any large enough subset of symbols
+# rebuilds the data no matter which seeds were missed.
+
+import math
+import random
+from bisect import bisect_left
+from binascii import hexlify, unhexlify
+
+LT_C = 0.03
+LT_DELTA = 0.5
+
+
+def xor_bytes(a, b):
+    x = int(hexlify(a), 16) ^ int(hexlify(b), 16)
+    return unhexlify('%0*x' % (len(a) * 2, x))
+
+
+def soliton_cdf(k, c=LT_C, delta=LT_DELTA):
+    r = c * math.log(k / delta) * math.sqrt(k)
+    spike = max(1, min(k, int(round(k / r)))) if r > 0 else k
+    weights = [0.0] * (k + 1)
+    for d in range(1, k + 1):
+        weights[d] = 1.0 / k if d == 1 else 1.0 / (d * (d - 1))
+        if d < spike:
+            weights[d] += r / (d * k)
+        elif d == spike:
+            weights[d] += r * math.log(r / delta) / k if r > delta else 0
+    total = sum(weights)
+    cdf = []
+    acc = 0.0
+    for d in range(1, k + 1):
+        acc += weights[d] / total
+        cdf.append(acc)
+    cdf[-1] = 1.0
+    return cdf
+
+
+def symbol_blocks(seed, k, cdf):
+    if seed < k:
+        return [seed]
+    # only random() is used, it is reproducible across python versions
+    rng = random.Random(seed)
+    degree = min(k, bisect_left(cdf, rng.random()) + 1)
+    blocks = set()
+    while len(blocks) < degree:
+        blocks.add(int(rng.random() * k))
+    return sorted(blocks)
+
+
+def block_count(length, block_size):
+    return max(1, int(math.ceil(float(length) / block_size)))
+
+
+class LTEncoder(object):
+
+    # data only needs len() and slicing, blocks are read when a symbol
+    # needs them
+
+    def __init__(self, data, block_size):
+        self.data = data
+        self.length = len(data)
+        self.block_size = block_size
+        self.k = block_count(self.length, block_size)
+        self.cdf = soliton_cdf(self.k)
+
+    def block(self, i):
+        block = self.data[i * self.block_size:(i + 1) * self.block_size]
+        return block + b'\x00' * (self.block_size - len(block))
+
+    def symbol(self, seed):
+        indexes = symbol_blocks(seed, self.k, self.cdf)
+        data = self.block(indexes[0])
+        for i in indexes[1:]:
+            data = xor_bytes(data, self.block(i))
+        return data
+
+
+class LTDecoder(object):
+
+    def __init__(self, k, block_size, length):
+        self.k = k
+        self.block_size = block_size
+        self.length = length
+        self.cdf = soliton_cdf(k)
+        self.blocks = [None] * k
+        self.known = 0
+        self.symbols = 0
+        self._seen = set()
+        self._waiting = {}
+
+    @property
+    def is_done(self):
+        return self.known == self.k
+
+    def add(self, seed, data):
+        # returns False for a symbol seen before
+        if seed in self._seen or self.is_done:
+            return False
+        if len(data) != self.block_size:
+            raise ValueError("symbol size %d != %d" %
+                             (len(data), self.block_size))
+        self._seen.add(seed)
+        self.symbols += 1
+
+        stack = [[set(symbol_blocks(seed, self.k, self.cdf)), data]]
+        while stack:
+            indexes, data = stack.pop()
+            for i in list(indexes):
+                if self.blocks[i] is not None:
+                    data = xor_bytes(data, self.blocks[i])
+                    indexes.discard(i)
+
+            if len(indexes) > 1:
+                equation = [indexes, data]
+                for i in indexes:
+                    self._waiting.setdefault(i, []).append(equation)
+            elif indexes:
+                i = indexes.pop()
+                self.blocks[i] = data
+                self.known += 1
+                # peel every pending symbol that referenced this block
+                for equation in self._waiting.pop(i, []):
+                    if equation[0]:
+                        stack.append([set(equation[0]), equation[1]])
+                        equation[0].clear()
+        return True
+
+    def result(self):
+        return b''.join(self.blocks)[:self.length]
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+from collections import OrderedDict
+
+from PyQt4 import QtCore
+from image_factory import matrixImage, colorImage, gridImage
+from stats import stage
+
+
+def frameKey(encoder, number, box_size):
+    return (number, encoder.ecc, box_size, encoder.frame_size,
+            encoder.endless, encoder.version)
+
+
+def tickKey(encoder, numbers, box_size, channels=1, columns=1):
+    # a single mono frame shares the key of the frame itself
+    if len(numbers) == 1 and channels == 1:
+        return frameKey(encoder, numbers[0], box_size)
+    return ("tick", channels, columns) + tuple(numbers) + \
+        frameKey(encoder, 0, box_size)
+
+
+def renderFrame(encoder, number, box_size, stats=None):
+    with stage(stats, 'encode'):
+        matrix = encoder.matrix(number)
+    with stage(stats, 'render'):
+        return matrixImage(matrix, box_size)
+
+
+def renderTick(encoder, numbers, box_size, channels=1, columns=1,
+               stats=None):
+    # the image shown on one tick: channels frames per symbol image, the
+    # symbol images side by side in a grid of columns
+    if channels > 1:
+        images = []
+        for i in range(0, len(numbers), channels):
+            with stage(stats, 'encode'):
+                matrices = encoder.matrices(numbers[i:i + channels])
+            with stage(stats, 'render'):
+                images.append(colorImage(matrices, box_size))
+    else:
+        images = [renderFrame(encoder, n, box_size, stats) for n in numbers]
+    if len(images) > 1:
+        with stage(stats, 'render'):
+            return gridImage(images, columns)
+    return images[0]
+
+
+class FrameCache(object):
+
+    # rendered QImages keyed by (frame number, ecc, image size, frame size,
+    # fountain mode, QR version), or by tickKey for a whole grid, shared
+    # between the GUI thread and the prefetcher. Bounded by the number of
+    # images and by their bytes, grid images get large.
+
+    def __init__(self, capacity=128, max_bytes=256 * 1024 * 1024):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            image = self._items.pop(key, None)
+            if image is not None:
+                self._items[key] = image
+            return image
+
+    def put(self, key, image):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= old.byteCount()
+            self._items[key] = image
+            self.bytes += image.byteCount()
+            while len(self._items) > 1 and (
+                    len(self._items) > self.capacity or
+                    self.bytes > self.max_bytes):
+                self.bytes -= self._items.popitem(last=False)[1].byteCount()
+
+    def fits(self, image):
+        # how many images of this size the cache holds
+        return max(1, min(self.capacity,
+                          self.max_bytes // max(image.byteCount(), 1)))
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+
+class FramePrefetcher(QtCore.QThread):
+
+    # renders the ticks ahead of the playhead into the cache
+
+    def __init__(self, cache, ahead=32, parent=None, stats=None):
+        QtCore.QThread.__init__(self, parent)
+        self.cache = cache
+        self.stats = stats
+        self.ahead = min(ahead, cache.capacity / 2)
+        self._cond = threading.Condition()
+        self._job = None
+        self._stopped = False
+
+    def schedule(self, encoder, box_size, ticks, channels=1, columns=1):
+        # ticks: frame numbers of the coming ticks, in playback order
+        with self._cond:
+            self._job = (encoder, box_size, ticks, channels, columns)
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self.wait()
+
+    def nextMissing(self, job):
+        encoder, box_size, ticks, channels, columns = job
+        for numbers in ticks[:self.ahead]:
+            key = tickKey(encoder, numbers, box_size, channels, columns)
+            if key not in self.cache:
+                return numbers, key
+        return None, None
+
+    def run(self):
+        while True:
+            with self._cond:
+                while self._job is None and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                job = self._job
+
+            numbers, key = self.nextMissing(job)
+            if key is None:
+                # window is full, sleep until the playhead moves
+                with self._cond:
+                    if self._job is job:
+                        self._job = None
+                continue
+
+            encoder, box_size, ticks, channels, columns = job
+            try:
+                image = renderTick(encoder, numbers, box_size, channels,
+                                   columns, self.stats)
+            except Exception as e:
+                # e.g. frames too large for a QR symbol or a failed read;
+                # drop this job, the next schedule may have valid settings
+                if self.stats:
+                    self.stats.count('prefetch_errors')
+                    self.stats.log('prefetch_error', frames=list(numbers),
+                                   error='%s: %s' % (type(e).__name__, e))
+                with self._cond:
+                    if self._job is job:
+                        self._job = None
+                continue
+            self.cache.put(key, image)
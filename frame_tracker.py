@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Received frame bookkeeping, one bit per frame number (1 based).
+#
+# add, discard, membership and the missing count are constant time. The
+# lowest missing frame is kept as a cursor that only moves forward while
+# frames arrive, so listing the next missing ranges is amortized constant
+# time instead of a scan over every frame number.
+
+import re
+
+_NOT_FULL = re.compile(b'[^\xff]')
+_NOT_EMPTY = re.compile(b'[^\x00]')
+
+
+class FrameTracker(object):
+
+    def __init__(self, total):
+        self.total = total
+        self.count = 0
+        self.bits = bytearray((total + 7) // 8)
+        self._cursor = 1
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, number):
+        if not 1 <= number <= self.total:
+            return False
+        i = number - 1
+        return bool(self.bits[i >> 3] & (1 << (i & 7)))
+
+    @property
+    def missing(self):
+        return self.total - self.count
+
+    @property
+    def is_complete(self):
+        return self.count == self.total
+
+    def add(self, number):
+        # returns False for duplicates and out of range numbers
+        if not 1 <= number <= self.total or number in self:
+            return False
+        i = number - 1
+        self.bits[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+        return True
+
+    def discard(self, number):
+        if number not in self:
+            return False
+        i = number - 1
+        self.bits[i >> 3] &= ~(1 << (i & 7)) & 0xff
+        self.count -= 1
+        self._cursor = min(self._cursor, number)
+        return True
+
+    def scan(self, start, pattern, present):
+        # first frame number >= start whose bit equals present, whole bytes
+        # are skipped by the regular expression at C speed
+        n = max(start, 1)
+        while n <= self.total and (n - 1) & 7:
+            if (n in self) == present:
+                return n
+            n += 1
+        if n > self.total:
+            return None
+        match = pattern.search(self.bits, (n - 1) >> 3)
+        if not match:
+            return None
+        n = match.start() * 8 + 1
+        while n <= self.total:
+            if (n in self) == present:
+                return n
+            n += 1
+        return None
+
+    def nextMissing(self, start=1):
+        return self.scan(start, _NOT_FULL, False)
+
+    def nextReceived(self, start=1):
+        return self.scan(start, _NOT_EMPTY, True)
+
+    def firstMissing(self):
+        if self.is_complete:
+            return None
+        self._cursor = self.nextMissing(self._cursor)
+        return self._cursor
+
+    def missingRanges(self, limit=3):
+        # [(first, last), ...] of up to limit runs of missing frames
+        ranges = []
+        n = self.firstMissing()
+        while n is not None and len(ranges) < limit:
+            last = (self.nextReceived(n) or self.total + 1) - 1
+            ranges.append((n, last))
+            n = self.nextMissing(last + 1)
+        return ranges
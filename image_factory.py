@@ -2,7 +2,67 @@
 # -*- coding: utf-8 -*-
 
 import qrcode
-from PyQt4 import QtGui, QtCore
+from PyQt4 import QtGui
+from encoder import scanlines, color_scanlines, QR_BORDER
+
+GRAY_TABLE = [QtGui.qRgb(i, i, i) for i in range(256)]
+
+
+def matrixImage(matrix, box_size, border=QR_BORDER):
+    # the whole symbol is built as one 8 bit buffer, scanlines are padded
+    # to the 32 bit alignment QImage expects
+    size = (len(matrix) + border * 2) * box_size
+    pad = b'\xff' * (-size % 4)
+    data = b''.join([line + pad
+                     for line in scanlines(matrix, box_size, border)])
+    image = QtGui.QImage(data, size, size, size + len(pad),
+                         QtGui.QImage.Format_Indexed8)
+    image.setColorTable(GRAY_TABLE)
+    # detach from the python string
+    return image.copy()
+
+
+def grayBytes(image):
+    # (width, height, 8 bit pixels without row padding) for zbar's Y800
+    image = image.convertToFormat(QtGui.QImage.Format_Indexed8, GRAY_TABLE)
+    width, height = image.width(), image.height()
+    bits = image.constBits()
+    bits.setsize(image.byteCount())
+    data = bits.asstring()
+    stride = image.bytesPerLine()
+    pixels = b''.join([data[y * stride:y * stride + width]
+                       for y in range(height)])
+    return width, height, pixels
+
+
+def colorImage(matrices, box_size, border=QR_BORDER):
+    # one symbol per rgb channel, see encoder.color_scanlines
+    size = (len(matrices[0]) + border * 2) * box_size
+    pad = b'\xff' * (-size * 3 % 4)
+    data = b''.join([line + pad for line in
+                     color_scanlines(matrices, box_size, border)])
+    image = QtGui.QImage(data, size, size, size * 3 + len(pad),
+                         QtGui.QImage.Format_RGB888)
+    return image.copy()
+
+
+def gridImage(images, columns):
+    # lay the symbols out row by row in equal cells, each symbol keeps its
+    # own quiet zone so the scanner sees them as separate codes
+    cell = max(image.width() for image in images)
+    rows = (len(images) + columns - 1) // columns
+    columns = min(columns, len(images))
+    grid = QtGui.QImage(cell * columns, cell * rows,
+                        QtGui.QImage.Format_RGB32)
+    grid.fill(QtGui.qRgb(255, 255, 255))
+
+    painter = QtGui.QPainter(grid)
+    for i, image in enumerate(images):
+        x = (i % columns) * cell + (cell - image.width()) // 2
+        y = (i // columns) * cell + (cell - image.height()) // 2
+        painter.drawImage(x, y, image)
+    painter.end()
+    return grid
 
 
 class ImageFactory(qrcode.image.base.BaseImage):
@@ -11,21 +71,23 @@ class ImageFactory(qrcode.image.base.BaseImage):
         self.border = border
         self.width = width
         self.box_size = box_size
-        size = (width + border * 2) * box_size
-        self._image = QtGui.QImage(
-            size, size, QtGui.QImage.Format_RGB16)
-        self._image.fill(QtCore.Qt.white)
+        self._modules = bytearray(width * width)
+        self._image = None
+
+    def image(self):
+        if self._image is None:
+            w = self.width
+            matrix = [self._modules[r * w:(r + 1) * w] for r in range(w)]
+            self._image = matrixImage(matrix, self.box_size, self.border)
+        return self._image
 
     def pixmap(self):
-        return QtGui.QPixmap.fromImage(self._image)
+        return QtGui.QPixmap.fromImage(self.image())
 
     def drawrect(self, row, col):
-        painter = QtGui.QPainter(self._image)
-        painter.fillRect(
-            (col + self.border) * self.box_size,
-            (row + self.border) * self.box_size,
-            self.box_size, self.box_size,
-            QtCore.Qt.black)
+        # only record the module, the image is rendered in one pass
+        self._modules[row * self.width + col] = 1
+        self._image = None
 
     def save(self, stream, kind=None):
         pass
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Per transfer receive journal. Every accepted symbol is appended as
+# varint length + symbol data, exactly as it was scanned, and replayed
+# through the receiver when the same transfer is scanned again. A record
+# cut short by a crash is ignored.
+#
+# A journal is named after the md5 of the data and the frame layout seen
+# in a symbol with the session header: frame kind, total and the payload
+# size of frame 1 (or of every fountain symbol), which follows from the
+# frame size or QR version and ECC level of the sender.
+
+import os
+import re
+from os.path import isdir, isfile, join
+
+from protocol import pack_varint, unpack_varint
+
+
+def journal_path(directory, packet):
+    # packet carries the session header
+    md5 = re.sub('[^0-9a-f]', '', packet.meta["md5"].lower())[:32]
+    kind = ('b' if packet.compact else 't') + \
+        ('lt' if packet.fountain else 'f')
+    return join(directory, '%s-%s-%d-%d.journal' % (
+        md5, kind, packet.total, len(packet.payload)))
+
+
+class Journal(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.fh = None
+
+    def records(self):
+        if not isfile(self.path):
+            return
+        fh = open(self.path, 'rb')
+        data = fh.read()
+        fh.close()
+
+        pos = 0
+        while pos < len(data):
+            try:
+                length, start = unpack_varint(data, pos)
+            except ValueError:
+                return
+            if start + length > len(data):
+                return
+            yield data[start:start + length]
+            pos = start + length
+
+    def append(self, data):
+        if self.fh is None:
+            directory = os.path.dirname(self.path)
+            if not isdir(directory):
+                os.makedirs(directory)
+            self.fh = open(self.path, 'ab')
+        self.fh.write(pack_varint(len(data)) + data)
+        self.fh.flush()
+
+    def close(self):
+        if self.fh:
+            self.fh.close()
+            self.fh = None
+
+    def remove(self):
+        self.close()
+        if isfile(self.path):
+            os.remove(self.path)
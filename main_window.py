@@ -20,13 +20,12 @@
 
 import sys
 import codecs
-import hashlib
-import zlib
-import base64
-from os.path import isfile, getsize, basename
+from os.path import isfile, isdir, getsize, basename
 
 from PyQt4 import QtGui, QtCore
 import icons_rc
+import encoder
+import archive
 from player_dialog import PlayerDialog
 from scanner_dialog import ScannerDialog
 
@@ -81,6 +80,19 @@ class MainWindow(QtGui.QMainWindow):
         action.triggered.connect(self.onConvertFile)
         self.toolbar.addAction(action)
 
+        action = QtGui.QAction(
+            QtGui.QIcon(':icons/qrfile.png'), 'QR Folder', self)
+        action.setStatusTip('Convert every file in a folder to QR code')
+        action.triggered.connect(self.onConvertFolder)
+        self.toolbar.addAction(action)
+
+        action = QtGui.QAction('Binary', self)
+        action.setCheckable(True)
+        action.setStatusTip(
+            'Raw binary frames with compact headers, needs zbar 0.23 or later')
+        self.binary_action = action
+        self.toolbar.addAction(action)
+
         action = QtGui.QAction(QtGui.QIcon(':icons/scan.png'), 'Scan', self)
         action.setStatusTip('Scan code')
         action.triggered.connect(self.onScan)
@@ -108,20 +120,21 @@ class MainWindow(QtGui.QMainWindow):
             self.scan_action.setEnabled(False)
 
 
-    def openFileDialog(self):
+    def openFileDialog(self, limit=const.MAX_FILE_SIZE):
         fd = QtGui.QFileDialog(self)
         filename = unicode(fd.getOpenFileName())
         if isfile(filename):
-            if getsize(filename) > const.MAX_FILE_SIZE:
+            if getsize(filename) > limit:
                 QtGui.QMessageBox.information(self, 'FlipQR', "File size can't greater than %d M" %
-                                              (const.MAX_FILE_SIZE / 1000 ** 2))
+                                              (limit / 1000 ** 2))
                 return False
             return filename
         else:
             return False
 
     def onOpen(self):
-        fn = self.openFileDialog()
+        # the streaming QR File path takes large files, the editor does not
+        fn = self.openFileDialog(const.MAX_TEXT_SIZE)
         if fn:
             self.filename = fn
             try:
@@ -149,43 +162,47 @@ class MainWindow(QtGui.QMainWindow):
                 self, 'FlipQR', "No content to convert")
             return True
 
-        src_md5 = hashlib.md5(text.encode('utf-8')).hexdigest()
-        source = {
-            "id": src_md5[0:6],
-            "data": text,
-            "type": const.TYPE_RAW_TEXT,
-            "md5": src_md5,
-        }
-
+        source = encoder.text_source(text, self.binary_action.isChecked())
         PlayerDialog(self, source).exec_()
 
     def onConvertFile(self):
         fn = self.openFileDialog()
         if fn:
             self.filename = fn
-            fh = open(self.filename, "rb")
-            raw = fh.read()
-            fh.close()
-            if not len(raw):
-                return
-            src_md5 = hashlib.md5(raw).hexdigest()
-            compressed = zlib.compress(raw)
-            if float(len(compressed)) / len(raw) < const.ZIP_RATIO_THRESHOLD:
-                data = base64.b64encode(compressed)
-                src_type = const.TYPE_ZIP_BASE64_FILE
-            else:
-                data = base64.b64encode(raw)
-                src_type = const.TYPE_BASE64_FILE
-
-            source = {
-                "id": src_md5[0:6],
-                "data": data,
-                "type": src_type,
-                "md5": src_md5,
-                "filename": basename(self.filename),
-            }
-
-            PlayerDialog(self, source).exec_()
+            self.playSource(basename(fn), encoder.file_source, fn)
+
+    def onConvertFolder(self):
+        fd = QtGui.QFileDialog(self)
+        directory = unicode(fd.getExistingDirectory())
+        if not isdir(directory):
+            return
+        files = archive.collect_files(directory)
+        if not files:
+            QtGui.QMessageBox.information(
+                self, 'FlipQR', "No files to convert")
+            return
+        if sum([size for _, _, size in files]) > const.MAX_FILE_SIZE:
+            QtGui.QMessageBox.information(self, 'FlipQR', "Folder size can't greater than %d M" %
+                                          (const.MAX_FILE_SIZE / 1000 ** 2))
+            return
+        self.playSource(basename(directory), encoder.folder_source, directory)
+
+    def playSource(self, name, make_source, path):
+        progress = QtGui.QProgressDialog(
+            "Preparing " + name, "", 0, 100, self)
+        progress.setCancelButton(None)
+        progress.setMinimumDuration(500)
+
+        def onProgress(done, total):
+            progress.setValue(done * 100 / total)
+            QtGui.qApp.processEvents()
+
+        source = make_source(path, self.binary_action.isChecked(), onProgress)
+        progress.close()
+        if not source:
+            return
+
+        PlayerDialog(self, source).exec_()
 
     def onScan(self):
         if not hasattr(self, "scanner"):
@@ -194,8 +211,9 @@ class MainWindow(QtGui.QMainWindow):
 
         self.scanner.reset()
         return_code = self.scanner.exec_()
-        if return_code == QtGui.QDialog.Accepted and self.scanner.source_type == const.TYPE_RAW_TEXT:
-            self.editor.setPlainText(unicode(self.scanner.result, "utf-8"))
+        receiver = self.scanner.receiver
+        if return_code == QtGui.QDialog.Accepted and receiver.source_type == const.TYPE_RAW_TEXT:
+            self.editor.setPlainText(unicode(receiver.result, "utf-8"))
 
     def onAbout(self):
         QtGui.QMessageBox.about(self, "FlipQR", "Version:%s <br><br>%s" % (
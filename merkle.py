@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Hash tree over the data stream. Every leaf covers a run of frames, the
+# root travels in the session header and the first frame of a leaf carries
+# the leaf hash with the sibling hashes up to the root, so the receiver can
+# check each run of frames on its own.
+#
+# A node without a sibling is carried up to the next level unchanged.
+
+import hashlib
+from multiprocessing.pool import ThreadPool
+
+HASH_SIZE = 16
+
+ALGO_BLAKE2B = 1
+ALGO_SHA256 = 2
+
+try:
+    _blake2b = hashlib.blake2b
+except AttributeError:
+    try:
+        from pyblake2 import blake2b as _blake2b
+    except ImportError:
+        _blake2b = None
+
+
+def _sha256(data):
+    return hashlib.sha256(data).digest()[:HASH_SIZE]
+
+
+def _blake2b_digest(data):
+    return _blake2b(data, digest_size=HASH_SIZE).digest()
+
+
+HASHES = {ALGO_SHA256: _sha256}
+if _blake2b:
+    HASHES[ALGO_BLAKE2B] = _blake2b_digest
+
+DEFAULT_ALGO = ALGO_BLAKE2B if _blake2b else ALGO_SHA256
+
+
+def leaf_hash(algo, data):
+    return HASHES[algo](b'\x00' + data)
+
+
+def node_hash(algo, left, right):
+    return HASHES[algo](b'\x01' + left + right)
+
+
+def proof_length(count):
+    # sibling hashes on the longest path from a leaf to the root
+    length = 0
+    while count > 1:
+        count = (count + 1) // 2
+        length += 1
+    return length
+
+
+def root_of(algo, index, count, leaf, proof):
+    # the root implied by a leaf and its proof, None for a malformed proof
+    node = leaf
+    proof = list(proof)
+    while count > 1:
+        if index % 2:
+            if not proof:
+                return None
+            node = node_hash(algo, proof.pop(0), node)
+        elif index + 1 < count:
+            if not proof:
+                return None
+            node = node_hash(algo, node, proof.pop(0))
+        index //= 2
+        count = (count + 1) // 2
+    return node if not proof else None
+
+
+class MerkleTree(object):
+
+    # every level is kept as one string of HASH_SIZE byte nodes
+
+    def __init__(self, algo, leaves):
+        self.algo = algo
+        self.levels = [leaves]
+        while len(self.levels[-1]) > HASH_SIZE:
+            level = self.levels[-1]
+            count = len(level) // HASH_SIZE
+            self.levels.append(b''.join([
+                node_hash(algo, self.node(level, i), self.node(level, i + 1))
+                if i + 1 < count else self.node(level, i)
+                for i in range(0, count, 2)]))
+
+    @staticmethod
+    def node(level, index):
+        return level[index * HASH_SIZE:(index + 1) * HASH_SIZE]
+
+    def leaf(self, index):
+        return self.node(self.levels[0], index)
+
+    @property
+    def root(self):
+        return self.levels[-1]
+
+    def proof(self, index):
+        proof = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(level) // HASH_SIZE:
+                proof.append(self.node(level, sibling))
+            index //= 2
+        return proof
+
+
+def build_tree(algo, count, read, threads=4, batch=1024):
+    # read(i) returns the data of leaf i. hashlib releases the GIL on large
+    # buffers, so the leaves are hashed in parallel threads, a batch at a
+    # time to keep memory flat
+    pool = ThreadPool(threads)
+    try:
+        leaves = []
+        for start in range(0, count, batch):
+            leaves.append(b''.join(pool.map(
+                lambda i: leaf_hash(algo, read(i)),
+                range(start, min(start + batch, count)))))
+    finally:
+        pool.close()
+        pool.join()
+    return MerkleTree(algo, b''.join(leaves))
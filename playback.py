@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Frame deadlines for the player. Tick k is due k intervals after playback
+# started on a monotonic millisecond clock, so a slow tick does not push
+# the later ones back. A tick shown more than LATE_FRACTION of an interval
+# after its deadline is late, ticks whose whole interval has passed are
+# dropped and playback continues with the one due now.
+
+LATE_FRACTION = 0.25
+
+
+class PlaybackClock(object):
+
+    def __init__(self, fps, now):
+        self.interval = 1000.0 / fps
+        self.origin = now
+        self.ticks = 0
+        self.shown = 0
+        self.dropped = 0
+        self.late = 0
+
+    def advance(self, now):
+        # ticks to move forward at time now, 0 when woken up early
+        due = int((now - self.origin) // self.interval)
+        if due <= self.ticks:
+            return 0
+        steps = due - self.ticks
+        self.dropped += steps - 1
+        if now - self.origin - due * self.interval > \
+                self.interval * LATE_FRACTION:
+            self.late += 1
+        self.ticks = due
+        self.shown += 1
+        return steps
+
+    def wait(self, now):
+        # milliseconds until the next tick is due
+        due = self.origin + (self.ticks + 1) * self.interval
+        return max(0, int(due - now + 0.5))
+
+    def rate(self, now):
+        # ticks shown per second so far
+        elapsed = now - self.origin
+        return self.shown * 1000.0 / elapsed if elapsed > 0 else 0.0
@@ -19,15 +19,24 @@
 
 
 import sys
+import time
 from os.path import isfile
 import codecs
-import qrcode
-import math
 
 from PyQt4 import QtGui, QtCore
-from image_factory import ImageFactory
+from encoder import make_encoder, MODE_FRAMES, MODE_FOUNTAIN, CHANNELS
+from frame_cache import FrameCache, FramePrefetcher, tickKey, renderTick
+from image_factory import grayBytes
+from playback import PlaybackClock
+from stats import Stats
+from ack import is_ack, parse_ack
 import constants as const
 
+try:
+    import zbar
+except ImportError:
+    zbar = None
+
 
 class PlayerDialog(QtGui.QDialog):
 
@@ -36,18 +45,16 @@ class PlayerDialog(QtGui.QDialog):
         self.setModal(True)
         self.source = source
 
-        self.ecc_dict = {
-            '7%': qrcode.constants.ERROR_CORRECT_L,
-            '15%': qrcode.constants.ERROR_CORRECT_M,
-            '25%': qrcode.constants.ERROR_CORRECT_Q,
-            '30%': qrcode.constants.ERROR_CORRECT_H
-        }
-
         self.options = {
             "ecc": ["7%", "15%", "25%", "30%"],
             "image_size":  [str(i) for i in range(1, 11)],
             "frame_size": [str(i * 100) for i in range(1, 21)],
-            "fps":  [str(i) for i in range(1, 11)],
+            "fps":  [str(i) for i in
+                     range(1, 11) + [12, 15, 20, 24, 30, 45, 60]],
+            "mode": [MODE_FRAMES, MODE_FOUNTAIN],
+            "version": ["auto"] + [str(i) for i in range(1, 41)],
+            "grid": ["1x1", "2x1", "2x2", "3x2", "3x3", "4x3", "4x4"],
+            "colors": ["mono", "rgb"],
         }
 
         self.settings = {
@@ -55,8 +62,22 @@ class PlayerDialog(QtGui.QDialog):
             "image_size": "5",
             "frame_size": "100",
             "fps": "1",
+            "mode": MODE_FRAMES,
+            "version": "auto",
+            "grid": "1x1",
+            "colors": "mono",
         }
+        # frame numbers still missing at the receiver, None plays them all
+        self.playlist = None
+        # ticks follow a monotonic clock, see playback.PlaybackClock
         self.timer = QtCore.QBasicTimer()
+        self.clock = QtCore.QElapsedTimer()
+        self.playback = None
+        self.cache = FrameCache()
+        self.stats = Stats('player')
+        self.prefetcher = FramePrefetcher(self.cache, parent=self,
+                                          stats=self.stats)
+        self.prefetcher.start()
         self.setupUI()
         self.updateSettings()
 
@@ -84,12 +105,20 @@ class PlayerDialog(QtGui.QDialog):
 
         hbox.addWidget(QtGui.QLabel(' Frame Bytes: '))
 
-        combo = QtGui.QComboBox()
-        combo.addItems(self.options["frame_size"])
+        self.combo_frame_size = QtGui.QComboBox()
+        self.combo_frame_size.addItems(self.options["frame_size"])
         ci = self.options["frame_size"].index(self.settings["frame_size"])
-        combo.setCurrentIndex(ci)
-        combo.activated[str].connect(self.onSetFrameSize)
-        hbox.addWidget(combo)
+        self.combo_frame_size.setCurrentIndex(ci)
+        self.combo_frame_size.activated[str].connect(self.onSetFrameSize)
+        hbox.addWidget(self.combo_frame_size)
+
+        hbox.addWidget(QtGui.QLabel(' QR Version: '))
+        self.combo_version = QtGui.QComboBox()
+        self.combo_version.addItems(self.options["version"])
+        ci = self.options["version"].index(self.settings["version"])
+        self.combo_version.setCurrentIndex(ci)
+        self.combo_version.activated[str].connect(self.onSetVersion)
+        hbox.addWidget(self.combo_version)
 
         hbox.addWidget(QtGui.QLabel(' FPS: '))
         self.combo_fps = QtGui.QComboBox()
@@ -99,6 +128,30 @@ class PlayerDialog(QtGui.QDialog):
         self.combo_fps.activated[str].connect(self.onSetFPS)
         hbox.addWidget(self.combo_fps)
 
+        hbox.addWidget(QtGui.QLabel(' Mode: '))
+        combo = QtGui.QComboBox()
+        combo.addItems(self.options["mode"])
+        ci = self.options["mode"].index(self.settings["mode"])
+        combo.setCurrentIndex(ci)
+        combo.activated[str].connect(self.onSetMode)
+        hbox.addWidget(combo)
+
+        hbox.addWidget(QtGui.QLabel(' Grid: '))
+        combo = QtGui.QComboBox()
+        combo.addItems(self.options["grid"])
+        ci = self.options["grid"].index(self.settings["grid"])
+        combo.setCurrentIndex(ci)
+        combo.activated[str].connect(self.onSetGrid)
+        hbox.addWidget(combo)
+
+        hbox.addWidget(QtGui.QLabel(' Colors: '))
+        combo = QtGui.QComboBox()
+        combo.addItems(self.options["colors"])
+        ci = self.options["colors"].index(self.settings["colors"])
+        combo.setCurrentIndex(ci)
+        combo.activated[str].connect(self.onSetColors)
+        hbox.addWidget(combo)
+
         self.icon_play = QtGui.QIcon(":icons/play.png")
         self.icon_pause = QtGui.QIcon(":icons/pause.png")
 
@@ -118,6 +171,24 @@ class PlayerDialog(QtGui.QDialog):
         hbox.addWidget(self.btn_play_pause)
         hbox.addWidget(self.btn_next)
 
+        # the receiver's acknowledgement narrows playback to missing frames
+        menu = QtGui.QMenu(self)
+        self.action_ack_camera = menu.addAction('Scan with camera')
+        self.action_ack_camera.triggered.connect(self.onAckCamera)
+        self.action_ack_camera.setEnabled(bool(zbar))
+        action = menu.addAction('Load image...')
+        action.triggered.connect(self.onAckImage)
+        action = menu.addAction('Play all frames')
+        action.triggered.connect(self.onPlayAll)
+        self.btn_ack = QtGui.QPushButton('Ack')
+        self.btn_ack.setMenu(menu)
+        hbox.addWidget(self.btn_ack)
+
+        self.btn_stats = QtGui.QPushButton('Stats')
+        self.btn_stats.setCheckable(True)
+        self.btn_stats.toggled.connect(self.onToggleStats)
+        hbox.addWidget(self.btn_stats)
+
         self.slider = QtGui.QSlider(QtCore.Qt.Horizontal)
         self.slider.setFocusPolicy(QtCore.Qt.NoFocus)
         self.slider.setMinimum(1)
@@ -137,37 +208,150 @@ class PlayerDialog(QtGui.QDialog):
         self.lbl_info.setAlignment(QtCore.Qt.AlignCenter)
         vbox.addWidget(self.lbl_info)
 
+        self.lbl_stats = QtGui.QLabel('')
+        self.lbl_stats.setAlignment(QtCore.Qt.AlignCenter)
+        self.lbl_stats.setVisible(False)
+        vbox.addWidget(self.lbl_stats)
+
         self.setLayout(vbox)
         if self.source['type'] == 0:
             title = 'FlipQR text'
+        elif self.source['type'] in const.ARCHIVE_TYPES:
+            title = 'FlipQR folder:' + self.source['filename']
         else:
             title = 'FlipQR file:' + self.source['filename']
 
         self.setWindowTitle(title)
         self.show()
 
+    def done(self, result):
+        self.timer.stop()
+        self.prefetcher.stop()
+        self.stats.log('closed', stats=self.stats.snapshot())
+        self.stats.close()
+        QtGui.QDialog.done(self, result)
+
     def timerEvent(self, e):
-        self.onNext()
+        self.onTick()
 
     def sliderValueChanged(self, value):
         self.paintQR(value)
 
     def updateSettings(self):
+        self.stopPlayback()
+        # other settings make other frames, an acknowledgement no longer fits
+        self.playlist = None
+
+        version = self.settings['version']
+        try:
+            self.encoder = make_encoder(self.source,
+                                        self.settings['frame_size'],
+                                        self.settings['ecc'],
+                                        self.settings['mode'],
+                                        int(version) if version != "auto" else None)
+        except ValueError:
+            QtGui.QMessageBox.information(
+                self, 'FlipQR', "QR version %s is too small for the frame header" % version)
+            self.settings['version'] = "auto"
+            self.combo_version.setCurrentIndex(0)
+            self.updateSettings()
+            return
+        self.combo_frame_size.setEnabled(not self.encoder.version)
+        self.total_frame = self.encoder.total_frames
+        self.btn_ack.setEnabled(not self.encoder.endless)
+        self.updatePlayback()
+
+    def updatePlayback(self):
         self.current_frame = 1
-
-        self.timer.stop()
-        self.btn_play_pause.setIcon(self.icon_play)
-
-        total = float(len(self.source['data'])) / \
-            int(self.settings['frame_size'])
-
-        self.total_frame = int(math.ceil(total))
-        self.is_static = int(self.settings['frame_size']) >= len(
-            self.source['data'])
-        self.slider.setMaximum(self.total_frame)
+        # a grid that holds every frame needs no playback either
+        self.is_static = self.encoder.is_static or (
+            not self.encoder.endless and
+            self.playCount() <= self.framesPerTick())
+        if self.is_static:
+            self.stopPlayback()
+        self.slider.setMaximum(self.playCount())
         self.updateUIStatus()
         self.paintQR(self.current_frame)
 
+    def playCount(self):
+        return len(self.playlist) if self.playlist else self.total_frame
+
+    def setPlaylist(self, playlist):
+        self.stopPlayback()
+        self.playlist = playlist
+        self.updatePlayback()
+
+    def onPlayAll(self):
+        self.setPlaylist(None)
+
+    def onAckCamera(self):
+        proc = zbar.Processor()
+        proc.parse_config('enable')
+        try:
+            proc.init('')
+        except Exception:
+            QtGui.QMessageBox.information(self, 'FlipQR', "No camera found")
+            return
+        proc.visible = True
+        try:
+            # until an acknowledgement shows up or the video window closes
+            while True:
+                proc.process_one()
+                found = [str(symbol.data) for symbol in proc.results
+                         if is_ack(str(symbol.data))]
+                if found:
+                    self.applyAck(found[0])
+                    break
+        except Exception as e:
+            # the video window was closed
+            self.stats.log('ack_camera_closed', error=repr(e))
+        proc.visible = False
+
+    def onAckImage(self):
+        fd = QtGui.QFileDialog(self)
+        filename = unicode(fd.getOpenFileName(self, 'Acknowledgement image'))
+        if not filename:
+            return
+        if not zbar:
+            QtGui.QMessageBox.information(
+                self, 'FlipQR', "Python zbar package not found")
+            return
+        image = QtGui.QImage(filename)
+        if image.isNull():
+            QtGui.QMessageBox.information(
+                self, 'FlipQR', "Can't read %s" % filename)
+            return
+        width, height, pixels = grayBytes(image)
+        scanner = zbar.ImageScanner()
+        scanner.parse_config('enable')
+        zimage = zbar.Image(width, height, 'Y800', pixels)
+        scanner.scan(zimage)
+        found = [str(symbol.data) for symbol in zimage
+                 if is_ack(str(symbol.data))]
+        if not found:
+            QtGui.QMessageBox.information(
+                self, 'FlipQR', "No acknowledgement code in %s" % filename)
+            return
+        self.applyAck(found[0])
+
+    def applyAck(self, text):
+        try:
+            session, total, missing = parse_ack(text)
+        except ValueError:
+            QtGui.QMessageBox.information(
+                self, 'FlipQR', "Unreadable acknowledgement, scan it again")
+            return
+        if session != self.source['id'] or total != self.total_frame:
+            QtGui.QMessageBox.information(
+                self, 'FlipQR', "The acknowledgement is for another transfer "
+                "or other frame settings")
+            return
+        if not missing:
+            QtGui.QMessageBox.information(
+                self, 'FlipQR', "The receiver has every frame")
+            return
+        self.setPlaylist(missing)
+
     def updateUIStatus(self):
         if self.is_static:
             self.btn_prev.setEnabled(False)
@@ -180,89 +364,190 @@ class PlayerDialog(QtGui.QDialog):
             self.btn_next.setEnabled(True)
             self.btn_play_pause.setEnabled(True)
             self.combo_fps.setEnabled(True)
-            self.slider.setEnabled(True)
+            self.slider.setEnabled(not self.encoder.endless)
 
     def onSetEcc(self, text):
         self.settings['ecc'] = str(text)
         self.updateSettings()
 
     def onSetImageSize(self, text):
+        # this, the grid and the colours change how the frames are shown,
+        # not the frames, an acknowledgement still applies
         self.settings['image_size'] = str(text)
-        self.updateSettings()
+        self.updatePlayback()
 
     def onSetFrameSize(self, text):
         self.settings['frame_size'] = str(text)
         self.updateSettings()
 
     def onSetFPS(self, text):
+        # the frames stay the same, only the clock starts over
         self.settings['fps'] = str(text)
+        if self.timer.isActive():
+            self.startPlayback()
+
+    def onSetVersion(self, text):
+        self.settings['version'] = str(text)
+        self.updateSettings()
+
+    def onSetMode(self, text):
+        self.settings['mode'] = str(text)
         self.updateSettings()
 
+    def onSetGrid(self, text):
+        self.settings['grid'] = str(text)
+        self.updatePlayback()
+
+    def onSetColors(self, text):
+        self.settings['colors'] = str(text)
+        self.updatePlayback()
+
+    def channels(self):
+        # frames per symbol image, rgb images carry one in each channel
+        return CHANNELS if self.settings['colors'] == "rgb" else 1
+
+    def gridColumns(self):
+        return int(self.settings['grid'].split('x')[0])
+
+    def gridSize(self):
+        columns, rows = self.settings['grid'].split('x')
+        return int(columns) * int(rows)
+
+    def framesPerTick(self):
+        return self.gridSize() * self.channels()
+
+    def gridFrames(self, first):
+        # frame numbers shown together, starting at playback position first
+        if self.encoder.endless:
+            return range(first, first + self.framesPerTick())
+        total = self.playCount()
+        count = min(self.framesPerTick(), total)
+        positions = [(first - 1 + i) % total + 1 for i in range(count)]
+        if self.playlist:
+            return [self.playlist[p - 1] for p in positions]
+        return positions
+
+    def tickImage(self, numbers, box_size):
+        channels, columns = self.channels(), self.gridColumns()
+        key = tickKey(self.encoder, numbers, box_size, channels, columns)
+        image = self.cache.get(key)
+        if image is None:
+            # the prefetcher fell behind
+            self.stats.count('cache_misses')
+            image = renderTick(self.encoder, numbers, box_size, channels,
+                               columns, self.stats)
+            self.cache.put(key, image)
+        return image
+
+    def onToggleStats(self, checked):
+        self.lbl_stats.setVisible(checked)
+        self.updateStats()
+
+    def updateStats(self):
+        if not self.lbl_stats.isVisible():
+            return
+        text = self.stats.text()
+        if self.playback:
+            text += "\n%d dropped, %d late" % (self.playback.dropped,
+                                               self.playback.late)
+        self.lbl_stats.setText(text)
+
+    def upcomingTicks(self, number, image):
+        # frame numbers of the ticks after position number, as many as the
+        # cache holds next to the ones on screen
+        step = self.framesPerTick()
+        count = min(self.prefetcher.ahead, self.cache.fits(image) // 2)
+        if not self.encoder.endless:
+            count = min(count, (self.playCount() + step - 1) // step)
+        return [self.gridFrames(self.positionAfter(number, i))
+                for i in range(1, count + 1)]
+
+    def positionAfter(self, number, ticks):
+        step = self.framesPerTick() * ticks
+        if self.encoder.endless:
+            return number + step
+        return (number - 1 + step) % self.playCount() + 1
+
     def onPlayPause(self):
-        delay = 1000 / int(self.settings['fps'])
         if self.timer.isActive():
-            self.timer.stop()
-            self.btn_play_pause.setIcon(self.icon_play)
-
+            self.stopPlayback()
         else:
-            self.timer.start(delay, self)
-            self.btn_play_pause.setIcon(self.icon_pause)
+            self.startPlayback()
 
-    def onNext(self):
-        if self.current_frame == self.total_frame:
-            self.current_frame = 1
-        else:
-            self.current_frame += 1
+    def startPlayback(self):
+        self.clock.start()
+        self.playback = PlaybackClock(int(self.settings['fps']),
+                                      self.clock.elapsed())
+        self.timer.start(self.playback.wait(self.clock.elapsed()), self)
+        self.btn_play_pause.setIcon(self.icon_pause)
 
-        self.paintQR(self.current_frame)
+    def stopPlayback(self):
+        self.timer.stop()
+        self.btn_play_pause.setIcon(self.icon_play)
+
+    def onTick(self):
+        # one timer event per tick; after a stall the ticks that were due
+        # meanwhile are dropped and the one due now is shown
+        steps = self.playback.advance(self.clock.elapsed())
+        if steps:
+            self.current_frame = self.positionAfter(self.current_frame, steps)
+            self.paintQR(self.current_frame)
+        self.timer.start(self.playback.wait(self.clock.elapsed()), self)
+
+    def onNext(self):
+        self.paintQR(self.positionAfter(self.current_frame, 1))
 
     def onPrevious(self):
-        if self.current_frame == 1:
-            self.current_frame = self.total_frame
+        step = self.framesPerTick()
+        if self.encoder.endless:
+            if self.current_frame == 1:
+                return
+            self.current_frame = max(1, self.current_frame - step)
         else:
-            self.current_frame -= 1
+            self.current_frame = \
+                (self.current_frame - 1 - step) % self.playCount() + 1
 
         self.paintQR(self.current_frame)
 
     def paintQR(self, number):
         self.current_frame = number
-        self.slider.setValue(number)
-
-        if self.is_static and self.source['type'] == 0:
-            qrtext = self.source['data'].encode('utf-8')
+        if not self.encoder.endless:
+            # moving the slider would paint the frame a second time
+            self.slider.blockSignals(True)
+            self.slider.setValue(number)
+            self.slider.blockSignals(False)
+
+        box_size = int(self.settings['image_size'])
+        numbers = self.gridFrames(number)
+        started = time.time()
+        image = self.tickImage(numbers, box_size)
+        with self.stats.stage('paint'):
+            self.lbl_qr.setPixmap(QtGui.QPixmap.fromImage(image))
+        self.stats.log('tick', frames=numbers,
+                       ms=(time.time() - started) * 1000,
+                       dropped=self.playback.dropped if self.playback else 0)
+        self.prefetcher.schedule(self.encoder, box_size,
+                                 self.upcomingTicks(number, image),
+                                 self.channels(), self.gridColumns())
+
+        if self.playlist:
+            shown = ",".join([str(n) for n in numbers])
+        elif len(numbers) > 1:
+            shown = "%d-%d" % (numbers[0], numbers[-1])
         else:
-            from_ = (self.current_frame - 1) * int(self.settings['frame_size'])
-            to = min(len(self.source['data']),
-                     from_ + int(self.settings['frame_size']))
-            qrtext = self.source['data'][from_:to].encode('utf-8')
-
-            if self.current_frame == 1:
-                # convert file
-                if self.source["type"] == const.TYPE_RAW_TEXT:
-                    meta = "FLIPQR:%s:%d:%d:%s:%d\n" % (self.source["id"], self.current_frame,
-                                                        self.total_frame, self.source["md5"], self.source["type"])
-                else:
-                    meta = "FLIPQR:%s:%d:%d:%s:%d:%s\n" % (self.source["id"], self.current_frame,
-                                                           self.total_frame, self.source["md5"], self.source["type"], self.source["filename"])
-            else:
-                meta = "FLIPQR:%s:%d:%d\n" % (
-                    self.source["id"], self.current_frame, self.total_frame)
-
-            qrtext = meta + qrtext
-
-        ecc = self.ecc_dict[self.settings['ecc']]
-        qr = qrcode.QRCode(
-            error_correction=ecc,
-            box_size=int(self.settings['image_size']),
-            border=4,
-            image_factory=ImageFactory
-        )
-
-        qr.add_data(qrtext)
-        qr.make(fit=True)
-
-        self.lbl_qr.setPixmap(
-            qr.make_image().pixmap())
-
-        info = "%d / %d" % (self.current_frame, self.total_frame)
+            shown = "%d" % numbers[0]
+        if self.encoder.endless:
+            info = "symbol %s, %d blocks" % (shown, self.total_frame)
+        elif self.playlist:
+            info = "%s / %d, %d missing at the receiver" % (
+                shown, self.total_frame, len(self.playlist))
+        else:
+            info = "%s / %d" % (shown, self.total_frame)
+        if self.playback and self.timer.isActive():
+            now = self.clock.elapsed()
+            info += ", %.1f fps" % self.playback.rate(now)
+            if self.playback.dropped or self.playback.late:
+                info += ", %d dropped, %d late" % (self.playback.dropped,
+                                                   self.playback.late)
         self.lbl_info.setText(info)
+        self.updateStats()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Frame headers.
+#
+# Text frames (the original format, base64 or utf-8 payload):
+#
+#   FLIPQR/crc:source_id:frame number:total frames[:md5:source_type[:file name]]\n
+#   FLIPQRLT/crc:source_id:seed:blocks:length:md5:source_type[:file name]\n
+#
+# crc is the crc32 of everything after it, in 8 hex digits. Frames from
+# older senders have no /crc part and are not checked.
+#
+# Compact frames (binary mode, raw payload):
+#
+#   magic        2 bytes  MAGIC
+#   version      1 byte   VERSION
+#   flags        1 byte   FLAG_*
+#   session id   3 bytes  first 3 bytes of the source md5
+#   index        varint   frame number, or the symbol seed in fountain mode
+#   total        varint   total frames, or the block count in fountain mode
+#   offset       varint   payload offset in the data stream
+#   length       varint   payload length
+#   [meta]                if FLAG_META: md5 (16 bytes), varint source type,
+#                         varint data size, varint name length, utf-8 name
+#   [tree]                if FLAG_TREE (with FLAG_META): varint hash
+#                         algorithm, varint frames per leaf, root hash
+#   [codec]               if FLAG_CODEC (with FLAG_META): varint codec of
+#                         the data stream (see compression.py)
+#   [leaf]                if FLAG_LEAF: leaf hash, varint proof length,
+#                         proof hashes (see merkle.py)
+#   [block]               if FLAG_BLOCK: varint distance from offset to the
+#                         first compressed block starting in this frame
+#   payload
+#   crc          4 bytes  big endian crc32 of all bytes before, FLAG_CRC
+#                         is always set and frames without it are rejected
+
+import zlib
+import base64
+import struct
+from binascii import hexlify, unhexlify
+from collections import namedtuple
+
+import constants as const
+from merkle import HASH_SIZE
+
+MAGIC = b'\xfbQ'
+VERSION = 1
+
+FLAG_META = 0x01
+FLAG_FOUNTAIN = 0x02
+FLAG_CRC = 0x04
+FLAG_TREE = 0x08
+FLAG_LEAF = 0x10
+FLAG_CODEC = 0x20
+FLAG_BLOCK = 0x40
+
+CRC_SIZE = 4
+
+# fountain symbols repeat the meta block every this many seeds. With a fixed
+# QR version the meta block is sent in frames of its own with an empty
+# payload, at least this many seeds apart.
+META_INTERVAL = 8
+
+# frames covered by one leaf of the hash tree
+LEAF_FRAMES = 16
+
+Packet = namedtuple('Packet', ['session', 'index', 'total', 'offset',
+                               'payload', 'fountain', 'meta', 'compact',
+                               'leaf', 'block'])
+
+
+class ChecksumError(ValueError):
+    pass
+
+
+def crc32(data):
+    return zlib.crc32(data) & 0xffffffff
+
+
+def add_crc(frame, prefix):
+    rest = frame[len(prefix):]
+    return prefix + '/%08x' % crc32(rest) + rest
+
+
+def check_crc(data, prefix):
+    # strips the crc of a text frame, raises ChecksumError on a mismatch
+    start = len(prefix)
+    if data[start:start + 1] != '/':
+        return data
+    rest = data[start + 9:]
+    if data[start + 1:start + 9] != '%08x' % crc32(rest):
+        raise ChecksumError("bad frame checksum")
+    return prefix + rest
+
+
+def is_flipqr(data):
+    return data.startswith('FLIPQR') or data.startswith(MAGIC)
+
+
+def pack_varint(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def varint_size(n):
+    # len(pack_varint(n))
+    return max(1, (n.bit_length() + 6) // 7)
+
+
+def unpack_varint(data, pos):
+    n = shift = 0
+    while True:
+        if pos >= len(data) or shift > 63:
+            raise ValueError("truncated varint")
+        byte = ord(data[pos:pos + 1])
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return n, pos
+
+
+def make_meta(source, size):
+    # file names from the command line are already utf-8 bytes
+    filename = source.get("filename", u"")
+    if isinstance(filename, unicode):
+        filename = filename.encode('utf-8')
+    return {
+        "md5": source["md5"],
+        "type": source["type"],
+        "size": size,
+        "filename": filename,
+        "codec": source.get("codec", 0),
+    }
+
+
+def pack_header(session, index, total, offset, length,
+                fountain=False, meta=None, leaf=None,
+                block=None):
+    # leaf: (leaf hash, proof hashes), block: distance to a block start
+    tree = meta.get("tree") if meta else None
+    codec = meta.get("codec") if meta else None
+    flags = (FLAG_META if meta else 0) | (FLAG_FOUNTAIN if fountain else 0) \
+        | FLAG_CRC | (FLAG_TREE if tree else 0) \
+        | (FLAG_LEAF if leaf else 0) | (FLAG_CODEC if codec else 0) \
+        | (FLAG_BLOCK if block is not None else 0)
+    parts = [MAGIC, bytes(bytearray([VERSION, flags])), unhexlify(session),
+             pack_varint(index), pack_varint(total),
+             pack_varint(offset), pack_varint(length)]
+    if meta:
+        parts += [unhexlify(meta["md5"]), pack_varint(meta["type"]),
+                  pack_varint(meta["size"]),
+                  pack_varint(len(meta["filename"])), meta["filename"]]
+    if tree:
+        algo, leaf_frames, root = tree
+        parts += [pack_varint(algo), pack_varint(leaf_frames), root]
+    if codec:
+        parts.append(pack_varint(codec))
+    if leaf:
+        leaf_hash, proof = leaf
+        parts += [leaf_hash, pack_varint(len(proof))] + list(proof)
+    if block is not None:
+        parts.append(pack_varint(block))
+    return b''.join(parts)
+
+
+def pack_frame(session, index, total, offset, payload,
+               fountain=False, meta=None, leaf=None, block=None):
+    frame = pack_header(session, index, total, offset, len(payload),
+                        fountain, meta, leaf=leaf, block=block) + payload
+    return frame + struct.pack('>I', crc32(frame))
+
+
+def text_frame(session, number, total, payload, meta=None):
+    if not meta:
+        header = "FLIPQR:%s:%d:%d\n" % (session, number, total)
+    elif meta["type"] == const.TYPE_RAW_TEXT:
+        header = "FLIPQR:%s:%d:%d:%s:%d\n" % (
+            session, number, total, meta["md5"], meta["type"])
+    else:
+        header = "FLIPQR:%s:%d:%d:%s:%d:%s\n" % (
+            session, number, total, meta["md5"], meta["type"],
+            meta["filename"])
+    return add_crc(header + payload, 'FLIPQR')
+
+
+def text_symbol(session, seed, blocks, payload, meta):
+    header = "FLIPQRLT:%s:%d:%d:%d:%s:%d" % (
+        session, seed, blocks, meta["size"], meta["md5"], meta["type"])
+    if meta["type"] != const.TYPE_RAW_TEXT:
+        header += ":" + meta["filename"]
+    if meta["type"] not in const.BINARY_TYPES:
+        payload = base64.b64encode(payload)
+    return add_crc(header + "\n" + payload, 'FLIPQRLT')
+
+
+def parse(data):
+    # raises ValueError for anything that is not a FlipQR frame
+    if data.startswith(MAGIC):
+        return parse_compact(data)
+    if data.startswith('FLIPQRLT'):
+        return parse_text_symbol(check_crc(data, 'FLIPQRLT'))
+    if data.startswith('FLIPQR'):
+        return parse_text_frame(check_crc(data, 'FLIPQR'))
+    raise ValueError("not a FlipQR frame")
+
+
+def parse_compact(data):
+    if len(data) < 7:
+        raise ValueError("truncated header")
+    version, flags = bytearray(data[2:4])
+    if version != VERSION:
+        raise ValueError("unsupported version %d" % version)
+
+    # every compact sender adds the crc, a frame without it has a misread
+    # flags byte
+    if not flags & FLAG_CRC or len(data) < 7 + CRC_SIZE or struct.unpack(
+            '>I', data[-CRC_SIZE:])[0] != crc32(data[:-CRC_SIZE]):
+        raise ChecksumError("bad frame checksum")
+    data = data[:-CRC_SIZE]
+
+    session = hexlify(data[4:7])
+    pos = 7
+    index, pos = unpack_varint(data, pos)
+    total, pos = unpack_varint(data, pos)
+    offset, pos = unpack_varint(data, pos)
+    length, pos = unpack_varint(data, pos)
+
+    meta = None
+    if flags & FLAG_META:
+        md5 = hexlify(data[pos:pos + 16])
+        source_type, pos = unpack_varint(data, pos + 16)
+        size, pos = unpack_varint(data, pos)
+        name_length, pos = unpack_varint(data, pos)
+        meta = {
+            "md5": md5,
+            "type": source_type,
+            "size": size,
+            "filename": data[pos:pos + name_length],
+        }
+        pos += name_length
+        if flags & FLAG_TREE:
+            algo, pos = unpack_varint(data, pos)
+            leaf_frames, pos = unpack_varint(data, pos)
+            meta["tree"] = (algo, leaf_frames, data[pos:pos + HASH_SIZE])
+            pos += HASH_SIZE
+        if flags & FLAG_CODEC:
+            meta["codec"], pos = unpack_varint(data, pos)
+
+    leaf = None
+    if flags & FLAG_LEAF:
+        leaf_hash = data[pos:pos + HASH_SIZE]
+        count, pos = unpack_varint(data, pos + HASH_SIZE)
+        if count > (len(data) - pos) // HASH_SIZE:
+            raise ValueError("truncated proof")
+        proof = [data[pos + i * HASH_SIZE:pos + (i + 1) * HASH_SIZE]
+                 for i in range(count)]
+        leaf = (leaf_hash, proof)
+        pos += count * HASH_SIZE
+
+    block = None
+    if flags & FLAG_BLOCK:
+        block, pos = unpack_varint(data, pos)
+
+    payload = data[pos:]
+    if len(payload) != length:
+        raise ValueError("payload length %d != %d" % (len(payload), length))
+    return Packet(session, index, total, offset, payload,
+                  bool(flags & FLAG_FOUNTAIN), meta, True, leaf, block)
+
+
+def parse_text_frame(data):
+    frame_data = data.split("\n", 1)
+    meta = frame_data[0].split(":")
+    if len(meta) < 4 or len(frame_data) < 2:
+        raise ValueError("bad frame header")
+
+    number = int(meta[2])
+    info = None
+    if number == 1:
+        info = {
+            "md5": meta[4],
+            "type": int(meta[5]),
+            "size": None,
+            "filename": ":".join(meta[6:]),
+        }
+    return Packet(meta[1], number, int(meta[3]), None, frame_data[1],
+                  False, info, False, None, None)
+
+
+def parse_text_symbol(data):
+    frame_data = data.split("\n", 1)
+    meta = frame_data[0].split(":")
+    if len(meta) < 7 or len(frame_data) < 2:
+        raise ValueError("bad symbol header")
+
+    info = {
+        "md5": meta[5],
+        "type": int(meta[6]),
+        "size": int(meta[4]),
+        "filename": ":".join(meta[7:]),
+    }
+    payload = frame_data[1]
+    if info["type"] not in const.BINARY_TYPES:
+        payload = base64.b64decode(payload)
+    return Packet(meta[1], int(meta[2]), int(meta[3]), None, payload,
+                  True, info, False, None, None)
@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Qt free reassembly of scanned symbols, used by the scanner dialog
+
+import hashlib
+import base64
+import binascii
+import threading
+
+import constants as const
+import protocol
+import merkle
+import compression
+import ack
+from fountain import LTDecoder
+from journal import Journal, journal_path
+from frame_tracker import FrameTracker
+from block_decoder import BlockDecoder
+
+
+class Receiver(object):
+
+    def __init__(self, journal_dir=None):
+        # with a journal_dir every accepted symbol is kept on disk and an
+        # interrupted transfer resumes when it is scanned again
+        self.journal_dir = journal_dir
+        self.journal = None
+        # the scanner feeds symbols on its video thread while the GUI asks
+        # for the progress; resume feeds again and restart resets, so the
+        # lock is reentrant
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            if self.journal:
+                self.journal.close()
+            self.journal = None
+            # symbols accepted before the session header named the journal
+            self.unjournaled = []
+            self.resumed = 0
+            self.rejected = 0
+            self.discarded = 0
+            # every symbol fed, the ones that do not parse, the repeats of
+            # known ones and the payload bytes of the new ones
+            self.symbols = 0
+            self.malformed = 0
+            self.duplicates = 0
+            self.useful_bytes = 0
+            # (hash algorithm, frames per leaf, root) of a checkable hash tree
+            self.tree = None
+            self.leaf_hashes = {}
+            self.pending_leaves = {}
+            self.verified_leaves = set()
+            # compressed blocks are decompressed as their frames come in, after
+            # the hash tree verified them when there is one
+            self.offsets = []
+            self.block_marks = []
+            self.blocks = None
+            self.source_id = ''
+            # (total, payload, hash tree) of frame 1 as first received
+            self.first_frame = None
+            self.tracker = None
+            self.done_list = []
+            self.fountain = None
+            self.compact = False
+            self.is_done = False
+            self.is_success = False
+            self.total_frames = 0
+            self.source_md5 = ''
+            self.source_type = 0
+            self.source_filename = ''
+            self.source_size = None
+            self.source_codec = compression.CODEC_NONE
+            self.result = None
+            self.error = ''
+
+    def feed(self, data):
+        # returns True when the symbol added something new
+        with self.lock:
+            if self.is_done:
+                return False
+            self.symbols += 1
+
+            if not self.source_id and not protocol.is_flipqr(data):
+                self.result = data
+                self.is_done = True
+                self.is_success = True
+                return True
+
+            try:
+                packet = protocol.parse(data)
+            except protocol.ChecksumError:
+                # misread frame, wait for a clean repeat
+                self.rejected += 1
+                return False
+            except (ValueError, TypeError, IndexError):
+                self.malformed += 1
+                return False
+
+            if self.changedLayout(packet):
+                self.restart()
+
+            if self.journal_dir and not self.journal and packet.meta and \
+                    packet.session == (self.source_id or packet.session):
+                self.resume(packet)
+                if self.is_done:
+                    return True
+
+            if self.source_id and self.source_id != packet.session:
+                return False
+
+            if packet.fountain:
+                added = self.feedSymbol(packet)
+            else:
+                added = self.feedFrame(packet)
+            if added:
+                self.useful_bytes += len(packet.payload)
+            else:
+                self.duplicates += 1
+
+            if self.journal and added:
+                self.journal.append(data)
+                if self.is_done:
+                    # finished either way, a failed md5 should not be replayed
+                    self.journal.remove()
+            elif self.journal_dir and added:
+                self.unjournaled.append(data)
+            return added
+
+    def resume(self, packet):
+        # replay the journal into a fresh state, then the symbols of this
+        # scan so far. A journal whose frames do not verify is from other
+        # sender settings and is dropped.
+        journal = Journal(journal_path(self.journal_dir, packet))
+        journal_dir, pending = self.journal_dir, self.unjournaled
+        counts = (self.symbols, self.rejected, self.malformed,
+                  self.duplicates)
+        self.reset()
+        self.journal_dir = None
+        for data in journal.records():
+            if self.feed(data):
+                self.resumed += 1
+        if self.discarded or self.error or self.changedLayout(packet):
+            journal.remove()
+            self.reset()
+        self.journal_dir = journal_dir
+        self.journal = journal
+        for data in pending:
+            self.feed(data)
+        self.symbols, self.rejected, self.malformed, self.duplicates = counts
+        if self.is_done:
+            self.journal.remove()
+
+    def frameLayout(self, packet):
+        return (packet.total, packet.payload,
+                packet.meta.get("tree") if packet.meta else None)
+
+    def changedLayout(self, packet):
+        # a symbol of this session that does not fit the ones received: the
+        # sender restarted with other frame settings
+        if not self.source_id or packet.session != self.source_id:
+            return False
+        if packet.fountain != bool(self.fountain):
+            return True
+        if packet.fountain:
+            return packet.total != self.total_frames or \
+                bool(packet.payload and self.fountain.block_size and
+                     len(packet.payload) != self.fountain.block_size)
+        if packet.total != self.total_frames:
+            return True
+        return packet.index == 1 and self.first_frame is not None and \
+            self.frameLayout(packet) != self.first_frame
+
+    def restart(self):
+        # start over with the new frames, the old ones cannot verify
+        if self.journal:
+            self.journal.remove()
+        self.reset()
+
+    def feedFrame(self, packet):
+        if self.fountain or not 1 <= packet.index <= packet.total:
+            return False
+
+        if packet.meta:
+            self.setMeta(packet.meta)
+
+        if not self.source_id:
+            self.source_id = packet.session
+            self.compact = packet.compact
+            self.total_frames = packet.total
+            self.tracker = FrameTracker(self.total_frames)
+            self.done_list = [None] * self.total_frames
+            self.offsets = [None] * self.total_frames
+            self.block_marks = [None] * self.total_frames
+
+        if packet.index == 1 and self.first_frame is None:
+            self.first_frame = self.frameLayout(packet)
+
+        if not self.tracker.add(packet.index):
+            return False
+
+        self.done_list[packet.index - 1] = packet.payload
+        self.offsets[packet.index - 1] = packet.offset
+        self.block_marks[packet.index - 1] = packet.block
+
+        if packet.block is not None and not self.blocks:
+            self.blocks = BlockDecoder(self.receivedFrame, self.total_frames)
+            self.feedBlocks([n for n in range(1, self.total_frames + 1)
+                             if self.receivedFrame(n)])
+
+        if packet.meta and packet.meta.get("tree") and not self.tree:
+            self.setTree(packet.meta["tree"])
+        if packet.leaf:
+            self.addLeaf(packet.index, packet.leaf)
+        if self.tree:
+            self.checkLeaf((packet.index - 1) // self.tree[1])
+        else:
+            self.feedBlocks([packet.index])
+
+        # all frames were scanned
+        if self.tracker.is_complete:
+            self.finish("".join(self.done_list), decoded=self.compact)
+        return True
+
+    def setTree(self, tree):
+        algo, leaf_frames, root = tree
+        pending, self.pending_leaves = self.pending_leaves, {}
+        if algo not in merkle.HASHES or not leaf_frames:
+            # unknown hash, only the md5 of the result is checked
+            return
+        self.tree = tree
+        for number, leaf in pending.items():
+            self.addLeaf(number, leaf)
+        for index in list(self.leaf_hashes):
+            self.checkLeaf(index)
+
+    def leafFrames(self, index):
+        leaf_frames = self.tree[1]
+        first = index * leaf_frames + 1
+        return range(first, min(first + leaf_frames, self.total_frames + 1))
+
+    def addLeaf(self, number, leaf):
+        # leaf hash and proof from the first frame of a leaf
+        if not self.tree:
+            self.pending_leaves[number] = leaf
+            return
+        algo, leaf_frames, root = self.tree
+        if (number - 1) % leaf_frames:
+            return
+        index = (number - 1) // leaf_frames
+        count = (self.total_frames + leaf_frames - 1) // leaf_frames
+        leaf_hash, proof = leaf
+        if merkle.root_of(algo, index, count, leaf_hash, proof) == root:
+            self.leaf_hashes[index] = leaf_hash
+        else:
+            self.discardLeaf(index)
+
+    def checkLeaf(self, index):
+        if index in self.verified_leaves or index not in self.leaf_hashes:
+            return
+        numbers = self.leafFrames(index)
+        if any([n not in self.tracker for n in numbers]):
+            return
+        data = "".join([self.done_list[n - 1] for n in numbers])
+        if merkle.leaf_hash(self.tree[0], data) == self.leaf_hashes[index]:
+            self.verified_leaves.add(index)
+            self.feedBlocks(numbers)
+        else:
+            self.discardLeaf(index)
+
+    def discardLeaf(self, index):
+        # some frame of the leaf was wrong, scan all of them again
+        self.leaf_hashes.pop(index, None)
+        self.discardFrames(self.leafFrames(index))
+
+    def discardFrames(self, numbers):
+        for number in numbers:
+            if self.tracker.discard(number):
+                self.done_list[number - 1] = None
+                self.discarded += 1
+                if self.tree:
+                    self.verified_leaves.discard(
+                        (number - 1) // self.tree[1])
+
+    def feedBlocks(self, numbers):
+        if not self.blocks:
+            return
+        if self.blocks.codec is None and self.source_md5:
+            self.discardRanges(self.blocks.setCodec(self.source_codec))
+        for number in numbers:
+            if number in self.tracker:
+                self.discardRanges(self.blocks.frameAdded(
+                    number, self.block_marks[number - 1]))
+
+    def discardRanges(self, ranges):
+        for first, last in ranges:
+            self.discardFrames(range(first, last + 1))
+
+    def receivedFrame(self, number):
+        if self.done_list[number - 1] is None:
+            return None
+        if self.tree and \
+                (number - 1) // self.tree[1] not in self.verified_leaves:
+            return None
+        return self.offsets[number - 1], self.done_list[number - 1]
+
+    def feedSymbol(self, packet):
+        if self.source_id and not self.fountain:
+            return False
+
+        if not self.source_id:
+            self.source_id = packet.session
+            self.compact = packet.compact
+            self.fountain = LTDecoder(packet.total, len(packet.payload), 0)
+            self.total_frames = self.fountain.k
+
+        # a frame of only the meta block has no payload, the symbol size
+        # then comes with the first symbol
+        added = False
+        if packet.payload:
+            if not self.fountain.block_size:
+                self.fountain.block_size = len(packet.payload)
+            if len(packet.payload) != self.fountain.block_size:
+                return False
+            added = self.fountain.add(packet.index, packet.payload)
+        if packet.meta and not self.source_md5:
+            self.setMeta(packet.meta)
+            self.fountain.length = packet.meta["size"]
+            added = True
+
+        # the data is complete once enough symbols and one meta block
+        # have been seen
+        if self.fountain.is_done and self.source_md5:
+            self.finish(self.fountain.result(), decoded=True)
+        return added
+
+    def setMeta(self, meta):
+        self.source_md5 = meta["md5"]
+        self.source_type = meta["type"]
+        self.source_size = meta["size"]
+        self.source_codec = meta.get("codec", compression.CODEC_NONE)
+        self.source_filename = meta["filename"] \
+            if self.source_type != const.TYPE_RAW_TEXT else ""
+
+    def finish(self, data, decoded=False):
+        # decoded: data is already the raw (maybe compressed) file
+        self.is_done = True
+        codec = self.source_codec
+        if not codec and self.source_type in const.ZIP_TYPES:
+            # text frames and older senders
+            codec = compression.CODEC_ZLIB
+        if self.blocks:
+            # every block was decompressed as its frames came in
+            raw = self.blocks.result(len(data))
+            if raw is not None:
+                data, codec = raw, compression.CODEC_NONE
+        try:
+            if self.source_type in const.BASE64_TYPES and not decoded:
+                data = base64.b64decode(data)
+            if codec:
+                data = compression.decompress(codec, data)
+        except (TypeError, ValueError, binascii.Error):
+            self.error = 'Decode failed'
+            return
+
+        self.result = data
+        if hashlib.md5(self.result).hexdigest() == self.source_md5:
+            self.is_success = True
+        else:
+            self.error = 'md5 verify failed,please rescan'
+
+    def progress(self):
+        with self.lock:
+            if self.fountain:
+                return self.fountain.known, self.total_frames
+            if not self.tracker:
+                return 0, self.total_frames
+            return self.tracker.count, self.total_frames
+
+    def ackText(self):
+        # the acknowledgement of the frames received so far, None before the
+        # first frame and for fountain symbols, which need no resending
+        with self.lock:
+            if self.is_done or not self.tracker:
+                return None
+            return ack.pack_ack(self.source_id, self.total_frames,
+                                self.tracker.bits)
+
+    def statusText(self):
+        with self.lock:
+            if self.is_done:
+                return 'Done'
+
+            if self.fountain and not self.source_md5 and self.fountain.is_done:
+                return "Waiting for the session header"
+
+            if self.fountain:
+                status_text = "Symbols: %d, Blocks: %d / %d" % (
+                    self.fountain.symbols, self.fountain.known,
+                    self.fountain.k)
+                return status_text + self.countsText()
+
+            if not self.tracker:
+                return ''
+
+            missing = self.tracker.missing
+            ranges = self.tracker.missingRanges(3)
+            status_text = "Required Frames:" if missing > 1 \
+                else "Required Frame:"
+            status_text += " %s ..." if missing > sum(
+                [last - first + 1 for first, last in ranges]) else " %s "
+            requires = ",".join([str(first) if first == last
+                                 else "%d-%d" % (first, last)
+                                 for first, last in ranges])
+            status_text = status_text % requires
+            return status_text + self.countsText()
+
+    def countsText(self):
+        text = ""
+        if self.resumed:
+            text += " (%d resumed)" % self.resumed
+        if self.rejected:
+            text += " (%d rejected)" % self.rejected
+        if self.discarded:
+            text += " (%d discarded)" % self.discarded
+        if self.malformed:
+            text += " (%d unreadable)" % self.malformed
+        return text
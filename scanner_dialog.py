@@ -22,11 +22,11 @@ from PyQt4 import QtGui, QtCore
 from os.path import isfile
 import zbar
 import time
-import hashlib
-import zlib
-import base64
-import traceback
 import constants as const
+from receiver import Receiver
+from stats import Stats
+import archive
+from ack_dialog import AckDialog
 
 
 class ScannerDialog(QtGui.QDialog):
@@ -34,22 +34,21 @@ class ScannerDialog(QtGui.QDialog):
     def __init__(self, parent):
         QtGui.QDialog.__init__(self, parent)
         self.setModal(True)
+        self.receiver = Receiver(const.JOURNAL_DIR)
+        self.stats = Stats('scanner')
+        self.first_image = self.last_image = None
         self.setupUI()
 
     def reset(self):
-        self.source_id = ''
-        self.todo_list = []
-        self.done_list = []
-        self.is_done = False
-        self.is_success = False
-        self.total_frames = 0
-        self.source_md5 = ''
-        self.source_type = 0
-        self.source_filename = ''
+        self.receiver.reset()
+        self.stats.reset()
+        self.first_image = self.last_image = None
+        self.lbl_stats.setText('')
         self.progress_bar.setMaximum(100)
         self.progress_bar.setValue(0)
         self.lbl_status.setText('')
         self.btn_scan_finish.setText('Scan')
+        self.btn_ack.setEnabled(False)
         self.show()
         QtGui.qApp.processEvents()
 
@@ -61,19 +60,33 @@ class ScannerDialog(QtGui.QDialog):
         vbox.addWidget(self.progress_bar)
         self.lbl_status = QtGui.QLabel()
         vbox.addWidget(self.lbl_status)
+        self.lbl_stats = QtGui.QLabel()
+        self.lbl_stats.setVisible(False)
+        vbox.addWidget(self.lbl_stats)
         vbox.addStretch(1)
 
+        self.btn_stats = QtGui.QPushButton("Stats")
+        self.btn_stats.setCheckable(True)
+        self.btn_stats.toggled.connect(self.onToggleStats)
+
         self.btn_scan_finish = QtGui.QPushButton("Scan")
         self.btn_scan_finish.clicked.connect(self.onScanFinish)
         # self.btn_scan_finish.setEnabled(False)
 
+        # the missing frames as a QR code for the sender's camera
+        self.btn_ack = QtGui.QPushButton("Ack")
+        self.btn_ack.clicked.connect(self.onAck)
+        self.btn_ack.setEnabled(False)
+
         self.btn_cancel = QtGui.QPushButton("Cancel")
         self.btn_cancel.clicked.connect(self.onCancel)
         # self.btn_cancel.setEnabled(False)
 
         hbox = QtGui.QHBoxLayout()
+        hbox.addWidget(self.btn_stats)
         hbox.addStretch(1)
         hbox.addWidget(self.btn_scan_finish)
+        hbox.addWidget(self.btn_ack)
         hbox.addWidget(self.btn_cancel)
 
         vbox.addLayout(hbox)
@@ -82,136 +95,151 @@ class ScannerDialog(QtGui.QDialog):
         self.setWindowTitle('Scan')
         self.setFixedSize(300, 100)
 
-    def isFlipQR(self, text):
-        return text.startswith('FLIPQR')
-
     def dataHandler(self, proc, image, closure):
-        # only use first symbol
-        for symbol in image.symbols:
-            break
-
-        if not self.source_id and not self.isFlipQR(symbol.data):
-            self.result = str(symbol.data)
-            self.progress_bar.setValue(100)
-            self.is_done = True
-            self.is_success = True
-            self.lbl_status.setText('Done')
-            self.btn_scan_finish.setText('Finish')
-
-            QtGui.qApp.processEvents()
-            return
+        # this runs for every decoded image, possibly on the zbar video
+        # thread, so it only feeds the receiver; the widgets are refreshed
+        # at a fixed rate by startScan. A player in grid mode shows several
+        # frames at once, every symbol in the image is a frame of its own.
+        now = time.time()
+        if self.last_image is None:
+            self.first_image = now
+        else:
+            self.stats.add('image_interval', now - self.last_image)
+        self.last_image = now
 
-        # meta format: FLIPQR:source_id:frame number:total
-        # frames:md5:source_type:file name
+        receiver = self.receiver
+        symbols = added = 0
         try:
-            frame_data = str(symbol.data).split("\n", 1)
-            meta = frame_data[0].split(":")
-            if len(meta) < 4:
-                return
-
-            if self.source_id and self.source_id != meta[1]:
-                return
-
-            content = frame_data[1]
-            frame_number = int(meta[2])
-
-            if frame_number == 1:
-                self.source_md5 = meta[4]
-                self.source_type = int(meta[5])
-                self.source_filename = meta[6] if int(
-                    meta[5]) != const.TYPE_RAW_TEXT else ""
-
-            if not self.source_id:
-                self.source_id = meta[1]
-                self.total_frames = int(meta[3])
-                self.todo_list = range(1, self.total_frames + 1)
-                self.done_list = ['' for i in range(1, self.total_frames + 1)]
-                self.progress_bar.setMaximum(self.total_frames)
-
-            if self.done_list[frame_number - 1] != '':
-                return
-
-            self.todo_list.remove(frame_number)
-            self.done_list[frame_number - 1] = content
-
-            self.progress_bar.setValue(self.total_frames - len(self.todo_list))
-
-            status_text = "Required Frames:" if len(
-                self.todo_list) > 1 else "Required Frame:"
-            status_text += " %s ..." if len(self.todo_list) > 3 else " %s "
-            requires = ",".join(str(i) for i in self.todo_list[0:3])
-            self.lbl_status.setText(status_text % requires)
-
-            QtGui.qApp.processEvents()
+            with self.stats.stage('handler'):
+                for symbol in image.symbols:
+                    if receiver.is_done:
+                        break
+                    symbols += 1
+                    added += receiver.feed(str(symbol.data))
+        except Exception as e:
+            # a bad symbol must not end the scan, but it is counted
+            self.stats.count('handler_errors')
+            self.stats.log('error', where='dataHandler', error=repr(e))
+        self.stats.log('image', symbols=symbols, added=added)
+        if receiver.is_done and receiver.source_id:
+            self.stats.log('done', success=receiver.is_success,
+                           error=receiver.error, stats=self.statsSnapshot())
+            self.stopScan()
+
+    def statsSnapshot(self):
+        receiver = self.receiver
+        snapshot = self.stats.snapshot()
+        seconds = (self.last_image - self.first_image) \
+            if self.first_image else 0
+        snapshot["counters"].update({
+            "symbols": receiver.symbols,
+            "duplicates": receiver.duplicates,
+            "rejected": receiver.rejected,
+            "unreadable": receiver.malformed,
+            "discarded": receiver.discarded,
+            "useful_bytes": receiver.useful_bytes,
+        })
+        snapshot["useful_bytes_per_second"] = \
+            receiver.useful_bytes / seconds if seconds else 0.0
+        return snapshot
+
+    def statsText(self):
+        snapshot = self.statsSnapshot()
+        counters = snapshot["counters"]
+        lines = ["%s: %.2f ms mean, %.2f ms max" % (
+            name, timer["mean_ms"], timer["max_ms"])
+            for name, timer in sorted(snapshot["timers"].items())]
+        lines.append("%d symbols, %.0f%% duplicates, %d rejected, "
+                     "%d unreadable" % (
+                         counters["symbols"],
+                         100.0 * counters["duplicates"] /
+                         max(counters["symbols"], 1),
+                         counters["rejected"], counters["unreadable"]))
+        lines.append("%.0f useful bytes/s" %
+                     snapshot["useful_bytes_per_second"])
+        if counters.get("handler_errors"):
+            lines.append("%d handler errors" % counters["handler_errors"])
+        return "\n".join(lines)
+
+    def onToggleStats(self, checked):
+        self.lbl_stats.setVisible(checked)
+        self.setFixedSize(300, 200 if checked else 100)
+        self.refreshUI()
+
+    def refreshUI(self):
+        receiver = self.receiver
+        # the video thread may be feeding the receiver, read it in one go
+        with receiver.lock:
+            done, total = receiver.progress()
+            status = receiver.statusText()
+            can_ack = bool(receiver.tracker) and not receiver.is_done
+            is_done = receiver.is_done
+        self.progress_bar.setMaximum(max(total, 1))
+        self.progress_bar.setValue(done if total else int(is_done))
+        self.lbl_status.setText(status)
+        if self.lbl_stats.isVisible():
+            self.lbl_stats.setText(self.statsText())
+        self.btn_ack.setEnabled(can_ack)
+        if is_done:
+            self.btn_scan_finish.setText('Finish')
 
-            # all frames were scanned
-            if not self.todo_list and self.source_id:
-                self.is_done = True
-                self.lbl_status.setText('Done')
-                self.btn_scan_finish.setText('Finish')
-
-                QtGui.qApp.processEvents()
-
-                if self.source_type == const.TYPE_RAW_TEXT:
-                    self.result = "".join(self.done_list)
-                    if hashlib.md5(self.result).hexdigest() == self.source_md5:
-                        self.is_success = True
-                        self.stopScan()
-                        return
-                    else:
-                        QtGui.QMessageBox.information(
-                            self, 'FlipQR', 'md5 verify failed,please rescan')
-                        self.stopScan()
-                        return
-
-                else:
-                    result = "".join(self.done_list)
-                    try:
-                        result = base64.b64decode(result)
-                        if self.source_type == const.TYPE_ZIP_BASE64_FILE:
-                            result = zlib.decompress(result)
-                        self.result = result
-                    except:
-                        QtGui.QMessageBox.information(
-                            self, 'FlipQR', 'Decode failed')
-                        self.stopScan()
-                        return
-
-                    if hashlib.md5(self.result).hexdigest() == self.source_md5:
-                        self.is_success = True
-                        self.stopScan()
-                        return
-                    else:
-                        QtGui.QMessageBox.information(
-                            self, 'FlipQR', 'md5 verify failed,please rescan')
-                        self.stopScan()
-                        return
-
-        except Exception, e:
-            pass
-            # print traceback.print_exc()
+    def onAck(self):
+        with self.receiver.lock:
+            text = self.receiver.ackText()
+            missing = self.receiver.tracker.missing if text else 0
+        if text:
+            AckDialog(self, text, missing).exec_()
 
     def saveFile(self):
         fd = QtGui.QFileDialog(self)
         savefile = unicode(
-            fd.getSaveFileName(self, '', unicode(self.source_filename, "utf-8")))
+            fd.getSaveFileName(self, '', unicode(self.receiver.source_filename, "utf-8")))
         if savefile:
             fh = open(savefile, 'wb')
-            fh.write(self.result)
+            fh.write(self.receiver.result)
             fh.close()
         self.accept()
 
+    def saveFolder(self):
+        # unpack the archive below a chosen directory, files whose md5 does
+        # not match are left out
+        fd = QtGui.QFileDialog(self)
+        directory = unicode(fd.getExistingDirectory(
+            self, 'Unpack ' + unicode(self.receiver.source_filename, "utf-8")))
+        if not directory:
+            return
+        try:
+            written, failed = archive.unpack(self.receiver.result, directory)
+        except (ValueError, UnicodeDecodeError) as e:
+            QtGui.QMessageBox.information(self, 'FlipQR', "Unpack failed: %s" % e)
+            return
+        except (IOError, OSError) as e:
+            QtGui.QMessageBox.information(self, 'FlipQR', "Write failed: %s" % e)
+            return
+        message = "%d files unpacked" % len(written)
+        if failed:
+            message += "\nmd5 verify failed, not written:\n" + "\n".join(failed)
+        QtGui.QMessageBox.information(self, 'FlipQR', message)
+        self.accept()
+
     def initScan(self):
 
         if not hasattr(self, 'proc'):
             self.proc = zbar.Processor()
             self.proc.parse_config('enable')
+            try:
+                # hand over binary frames as raw bytes, without the
+                # text encoding guess (zbar 0.23 or later)
+                self.proc.parse_config('qrcode.binary')
+            except Exception:
+                pass
             self.device = ''
             try:
                 self.proc.init(self.device)
                 self.proc.set_data_handler(self.dataHandler)
                 self.proc.active = True
-            except:
+            except Exception as e:
+                self.stats.log('error', where='initScan', error=repr(e))
                 QtGui.QMessageBox.information(self, 'FlipQR',
                                               "Scan process initialize failed")
         else:
@@ -220,28 +248,39 @@ class ScannerDialog(QtGui.QDialog):
     def startScan(self):
         self.proc.visible = True
         self.setEnabled(False)
+        self.scanning = True
         QtGui.qApp.processEvents()
-        try:
-            ret = self.proc.user_wait()
-        except:
-            pass
+        while self.scanning:
+            try:
+                if self.proc.user_wait(const.UI_REFRESH_INTERVAL):
+                    # key pressed in the video window
+                    break
+            except Exception:
+                # video window closed
+                break
+            self.refreshUI()
+            QtGui.qApp.processEvents()
 
         self.proc.visible = False
         self.setEnabled(True)
+        self.refreshUI()
 
-        if self.is_done and not self.is_success:
+        if self.receiver.error:
+            QtGui.QMessageBox.information(self, 'FlipQR', self.receiver.error)
+        if self.receiver.is_done and not self.receiver.is_success:
             self.reject()
 
     def stopScan(self):
+        self.scanning = False
         if hasattr(self.proc, 'cancel_process'):
             self.proc.cancel_process()
-        else:
-            pass
 
     def onScanFinish(self):
-        if self.is_done:
-            if self.source_type == const.TYPE_RAW_TEXT:
+        if self.receiver.is_done:
+            if self.receiver.source_type == const.TYPE_RAW_TEXT:
                 self.accept()
+            elif self.receiver.source_type in const.ARCHIVE_TYPES:
+                self.saveFolder()
             else:
                 self.saveFile()
         else:
@@ -253,9 +292,12 @@ class ScannerDialog(QtGui.QDialog):
         self.startScan()
 
     def onCancel(self):
-        if self.source_id or self.is_done:
-            reply = QtGui.QMessageBox.question(self, "FlipQR",
-                                               "Are you sure to cancel?\n discarge unsaved data?",
+        if self.receiver.source_id or self.receiver.is_done:
+            if self.receiver.is_done:
+                message = "Are you sure to cancel?\n discarge unsaved data?"
+            else:
+                message = "Are you sure to cancel?\n scanned frames are kept, scan the same movie again to resume."
+            reply = QtGui.QMessageBox.question(self, "FlipQR", message,
                                                QtGui.QMessageBox.Yes, QtGui.QMessageBox.No)
 
             if reply == QtGui.QMessageBox.Yes:
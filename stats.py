@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Stage timers, counters and a structured log for the player and the
+# scanner. Timers and counters are kept in memory and shown in the stats
+# panels; with FLIPQR_STATS_LOG set every logged event is appended to that
+# file as one JSON object per line.
+#
+# With FLIPQR_PROFILE set the timed stages also run under cProfile, one
+# profiler per thread, and the merged profile is written to that file at
+# exit (read it with python -m pstats).
+
+import os
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+
+LOG_ENV = 'FLIPQR_STATS_LOG'
+PROFILE_ENV = 'FLIPQR_PROFILE'
+
+_profile_path = os.environ.get(PROFILE_ENV)
+_profiles = []
+_local = threading.local()
+
+
+class Timer(object):
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.last = seconds
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "max_ms": self.max * 1000,
+            "last_ms": self.last * 1000,
+        }
+
+
+class Stats(object):
+
+    def __init__(self, name, log_path=None):
+        self.name = name
+        self.log_path = log_path or os.environ.get(LOG_ENV)
+        self._log = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.timers = {}
+            self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.time()
+        with profile():
+            yield
+        self.add(name, time.time() - started)
+
+    def add(self, name, seconds):
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = Timer()
+            timer.add(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "elapsed": time.time() - self.started,
+                "timers": dict([(name, timer.snapshot())
+                                for name, timer in self.timers.items()]),
+                "counters": dict(self.counters),
+            }
+
+    def text(self):
+        # one line per timer and a line of counters, for the stats panels
+        snapshot = self.snapshot()
+        lines = ["%s: %.2f ms mean, %.2f ms max, %d times" % (
+            name, timer["mean_ms"], timer["max_ms"], timer["count"])
+            for name, timer in sorted(snapshot["timers"].items())]
+        if snapshot["counters"]:
+            lines.append(", ".join(["%s %d" % item for item in
+                                    sorted(snapshot["counters"].items())]))
+        return "\n".join(lines)
+
+    def log(self, event, **fields):
+        if not self.log_path:
+            return
+        fields.update({"time": time.time(), "source": self.name,
+                       "event": event})
+        line = json.dumps(fields, sort_keys=True)
+        with self._lock:
+            if self._log is None:
+                self._log = open(self.log_path, 'a')
+            self._log.write(line + '\n')
+            self._log.flush()
+
+    def close(self):
+        with self._lock:
+            if self._log:
+                self._log.close()
+            self._log = None
+
+
+@contextmanager
+def null_stage():
+    yield
+
+
+def stage(stats, name):
+    # stats.stage(name), or nothing for stats None
+    return stats.stage(name) if stats else null_stage()
+
+
+@contextmanager
+def profile():
+    if not _profile_path:
+        yield
+        return
+    profiler = getattr(_local, 'profiler', None)
+    if profiler is None:
+        import cProfile
+        profiler = _local.profiler = cProfile.Profile()
+        _local.depth = 0
+        _profiles.append(profiler)
+    _local.depth += 1
+    if _local.depth == 1:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+        if _local.depth == 0:
+            profiler.disable()
+
+
+def dump_profile():
+    if not _profiles:
+        return
+    import pstats
+    merged = pstats.Stats(_profiles[0])
+    for profiler in _profiles[1:]:
+        merged.add(profiler)
+    merged.dump_stats(_profile_path)
+
+
+if _profile_path:
+    atexit.register(dump_profile)
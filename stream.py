@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# FlipQR - transfer data over an air gap
+# Copyright GPLv2 2015 Huang Hongqing (hhqyn@hotmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Lazily evaluated source data. These objects stand in for the byte
+# strings in source['data']: they support len() and slicing, and read
+# only the requested range from disk.
+
+import base64
+import threading
+
+
+class FileData(object):
+
+    def __init__(self, fileobj, offset=0, size=None):
+        self.fileobj = fileobj
+        self.offset = offset
+        if size is None:
+            fileobj.seek(0, 2)
+            size = fileobj.tell() - offset
+        self.size = size
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        start, stop, step = key.indices(self.size)
+        if step != 1:
+            raise ValueError("only contiguous slices are supported")
+        if stop <= start:
+            return b''
+        # the player and the prefetcher read concurrently
+        with self._lock:
+            self.fileobj.seek(self.offset + start)
+            return self.fileobj.read(stop - start)
+
+
+class Base64Data(object):
+
+    # base64 text of the wrapped data, encoded one slice at a time
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def __len__(self):
+        return (len(self.raw) + 2) // 3 * 4
+
+    def __getitem__(self, key):
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            raise ValueError("only contiguous slices are supported")
+        if stop <= start:
+            return b''
+        # every 4 output characters come from 3 input bytes
+        first = start // 4
+        last = (stop + 3) // 4
+        text = base64.b64encode(self.raw[first * 3:last * 3])
+        return text[start - first * 4:stop - first * 4]